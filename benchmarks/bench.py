@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import threading
+import statistics
+import tracemalloc
+from datetime import datetime
+import pandas as pd
+import pyarrow as pa
+
+# the stub backend answers every model call locally, no network and no api key
+os.environ['LLM_BACKEND'] = 'stub'
+
+import odagg
+import odstore
+import schema
+import classes
+import cleaning
+import llmcache
+from benchmarks import synthetic
+
+# python -m benchmarks.bench [--scales 1 10 100] [--baseline benchmarks/baseline.json]
+RESULTS_DIR = 'benchmarks/results'
+BASELINE = 'benchmarks/baseline.json'
+# a case is flagged when its median time grows by more than this fraction
+THRESHOLD = 0.2
+# and by more than this many seconds, so sub-millisecond cases do not flag on noise
+MIN_DELTA_S = 0.005
+REPEAT = 5
+GPS_VEHICLES = 100
+CLEAR_OPTS = ['稀疏化', '删除漂移', '删除相同的数据', '删除瞬时变化']
+OP_OPTS = ['提取OD', '提取配送和闲置轨迹']
+GPS_COLS = {'id': 'VehicleNum', 'time': 'Time', 'lon': 'Lng', 'lat': 'Lat', 'status': 'OpenStatus'}
+
+
+def arrow_sampler(samples, stop, interval=0.001):
+    # Arrow buffers are allocated outside of tracemalloc and the pool has no resettable
+    # peak, so the allocated bytes are sampled while the traced run is going
+    while not stop.wait(interval):
+        samples.append(pa.total_allocated_bytes())
+
+
+def measure(func, rows=None, repeat=REPEAT, setup=None):
+    # wall time of repeat runs, then one more run under tracemalloc for the peak memory,
+    # tracing is kept out of the timed runs because it slows every allocation.
+    # peak_mb adds the arrow peak (arrow_mb) to the python peak
+    # one untimed run first, so lazy imports (transbigdata, duckdb) are not timed
+    state = setup() if setup else None
+    result = func(state) if setup else func()
+    times = []
+    for _ in range(repeat):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        result = func(state) if setup else func()
+        times.append(time.perf_counter() - start)
+    state = setup() if setup else None
+    samples = [pa.total_allocated_bytes()]
+    stop = threading.Event()
+    sampler = threading.Thread(target=arrow_sampler, args=(samples, stop), daemon=True)
+    tracemalloc.start()
+    sampler.start()
+    try:
+        # the result is kept until both are measured, its arrow buffers count too
+        traced_result = func(state) if setup else func()
+        peak = tracemalloc.get_traced_memory()[1]
+        samples.append(pa.total_allocated_bytes())
+    finally:
+        stop.set()
+        sampler.join()
+        tracemalloc.stop()
+    del traced_result
+    arrow = max(samples) - samples[0]
+    record = {'median_s': round(statistics.median(times), 6), 'min_s': round(min(times), 6),
+              'repeat': repeat, 'peak_mb': round((peak + arrow) / 2 ** 20, 2),
+              'arrow_mb': round(arrow / 2 ** 20, 2)}
+    if rows:
+        record['rows'] = rows
+        record['rows_per_s'] = round(rows / statistics.median(times))
+    return record, result
+
+
+def od_cases(scale, weeks, work_dir, repeat, data_dir=None):
+    # loading, KPIs and prompt building on the bundled weeks scaled scale times,
+    # generated data is kept in data_dir for the next run when it is given
+    od_dir = odstore.OD_DIR
+    if scale > 1:
+        od_dir = os.path.join(data_dir or work_dir, f'od_x{scale}')
+        if not all(os.path.isdir(os.path.join(od_dir, week)) for week in weeks):
+            print(f'generating OD data x{scale}', file=sys.stderr)
+            synthetic.scale_od(scale, od_dir, weeks)
+    store_dir = os.path.join(work_dir, f'store_x{scale}')
+    week = weeks[0]
+    raw_rows = sum(len(pd.read_csv(path, usecols=['id']))
+                   for _, path in odstore.day_files(week, od_dir))
+    cases = {}
+
+    def fresh_store():
+        odstore._tables.clear()
+        if os.path.exists(store_dir):
+            for root, _, files in os.walk(store_dir):
+                for name in files:
+                    os.remove(os.path.join(root, name))
+    cases['ingest_week'], _ = measure(
+        lambda state: odstore.ingest_week(week, od_dir, store_dir),
+        raw_rows, max(1, repeat // 2), setup=fresh_store)
+
+    def cold_tables():
+        odstore._tables.clear()
+    cases['load_week_cold'], data = measure(
+        lambda state: odstore.load_week(week, od_dir, store_dir), raw_rows, repeat,
+        setup=cold_tables)
+    cases['load_week_warm'], data = measure(
+        lambda: odstore.load_week(week, od_dir, store_dir), raw_rows, repeat)
+
+    cases['summarize_trips'], summary = measure(lambda: odagg.summarize_trips(data),
+                                                len(data), repeat)
+    cases['kpis'], _ = measure(lambda: (odagg.total_orders(summary), odagg.utilization(summary),
+                                        odagg.top_vehicles(summary)),
+                               len(summary), repeat)
+
+    def cold_profiles():
+        schema._profiles.clear()
+    cases['get_primer_cold'], primer = measure(
+        lambda state: classes.get_primer(data, 'datasets["Week1"]'), len(data), repeat,
+        setup=cold_profiles)
+    cases['get_primer_warm'], primer = measure(
+        lambda: classes.get_primer(data, 'datasets["Week1"]'), len(data), repeat)
+
+    question = classes.format_question(primer[0], primer[1], 'orders per hour', 'gpt-4')
+    cases['format_question'], _ = measure(
+        lambda: classes.format_question(primer[0], primer[1], 'orders per hour', 'gpt-4'),
+        repeat=repeat)
+    response = "df = pd.read_csv('data_file.csv')\n" + question
+    cases['format_response'], _ = measure(lambda: classes.format_response(response),
+                                          repeat=repeat)
+
+    # a new question every run, so each run misses the response cache and calls the gateway
+    questions = iter(range(10 ** 9))
+    cases['run_request_stub'], _ = measure(
+        lambda: classes.run_request(question + str(next(questions)), 'gpt-4', 'key', None),
+        repeat=repeat)
+    return cases
+
+
+def gps_cases(scale, repeat):
+    gps = synthetic.gps(GPS_VEHICLES * scale)
+    logs = []
+
+    def clean(frame):
+        logs.append(cleaning.RunLog(trace_memory=False))
+        return cleaning.run_steps(frame, GPS_COLS, CLEAR_OPTS, OP_OPTS, log=logs[-1])
+    record, _ = measure(clean, len(gps), max(1, repeat // 2), setup=gps.copy)
+    # stage times of the last timed run, the traced run after it is slower
+    record['stages'] = {stage['stage']: stage['seconds'] for stage in logs[-2].stages}
+    return {'cleaning_steps': record}
+
+
+def run(scales, weeks, repeat, data_dir=None):
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='bench_') as work_dir:
+        # answers of the stub backend go to a throwaway response cache
+        llmcache._cache = llmcache.ResponseCache(os.path.join(work_dir, 'responses.sqlite3'))
+        for scale in scales:
+            print(f'scale x{scale}', file=sys.stderr)
+            cases = od_cases(scale, weeks, work_dir, repeat, data_dir)
+            cases.update(gps_cases(scale, repeat))
+            for name, record in cases.items():
+                results[f'{name}@x{scale}'] = record
+        llmcache._cache = None
+    return {'meta': {'time': datetime.now().isoformat(timespec='seconds'),
+                     'python': platform.python_version(), 'pandas': pd.__version__,
+                     'machine': platform.machine(), 'cpus': os.cpu_count(),
+                     'scales': scales, 'weeks': weeks, 'repeat': repeat},
+            'results': results}
+
+
+def compare(current, baseline, threshold=THRESHOLD):
+    # cases whose fastest run grew by more than threshold against the baseline,
+    # the fastest run is the least disturbed by other load on the machine
+    regressions = []
+    print(f"{'case':32} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for name, record in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print(f"{name:32} {'-':>10} {record['min_s']:>10.4f}")
+            continue
+        ratio = record['min_s'] / max(base['min_s'], 1e-9)
+        flag = ''
+        if ratio > 1 + threshold and record['min_s'] - base['min_s'] > MIN_DELTA_S:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:32} {base['min_s']:>10.4f} {record['min_s']:>10.4f} {ratio:>7.2f}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark loading, aggregation, prompt '
+                                                 'building and cleaning.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10],
+                        help='data sizes relative to the bundled data, e.g. 1 10 100')
+    parser.add_argument('--weeks', nargs='+', default=['week1'])
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--data-dir', help='keep the generated OD data here between runs')
+    parser.add_argument('--output', help='result json, default benchmarks/results/<time>.json')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store this run as the baseline to compare later runs against')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    args = parser.parse_args(argv)
+
+    current = run(args.scales, args.weeks, args.repeat, args.data_dir)
+    output = args.output or os.path.join(
+        RESULTS_DIR, datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    for path in [output] + ([args.baseline] if args.save_baseline else []):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=1, ensure_ascii=False)
+    print(f'results written to {output}')
+    if args.save_baseline or not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare(current, baseline, args.threshold)
+    if regressions:
+        print(f'{len(regressions)} regression(s): ' + ', '.join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+import os
+import numpy as np
+import pandas as pd
+import odstore
+
+# 合成数据: 把自带的OD数据放大若干倍，以及生成任意规模的GPS轨迹
+# 成都市区的大致范围
+LON_RANGE = (103.95, 104.20)
+LAT_RANGE = (30.55, 30.78)
+TIME_FORMAT = '%Y/%m/%d %H:%M:%S'
+
+
+def scale_od_day(data, scale, rng):
+    # scale copies of one day, every copy gets its own vehicle ids and slightly moved
+    # times and coordinates so group sizes and cardinalities grow with the data
+    stime = pd.to_datetime(data['stime'], format='mixed')
+    etime = pd.to_datetime(data['etime'], format='mixed')
+    vehicles = int(data['id'].max()) + 1
+    copies = []
+    for copy in range(scale):
+        shift = pd.to_timedelta(rng.integers(-120, 120, len(data)) if copy else 0, unit='s')
+        frame = data.copy()
+        frame['id'] = data['id'] + copy * vehicles
+        frame['stime'] = (stime + shift).dt.strftime(TIME_FORMAT)
+        frame['etime'] = (etime + shift).dt.strftime(TIME_FORMAT)
+        if copy:
+            for column in ('slon', 'slat', 'elon', 'elat'):
+                frame[column] = (data[column] + rng.normal(0, 0.001, len(data))).round(6)
+        copies.append(frame)
+    data = pd.concat(copies, ignore_index=True)
+    data['ID'] = np.arange(len(data))
+    return data
+
+
+def scale_od(scale, target_dir, weeks=None, od_dir=odstore.OD_DIR, seed=0):
+    # write the bundled weeks scale times larger in the odddata layout,
+    # returns the number of rows written
+    rng = np.random.default_rng(seed)
+    rows = 0
+    for week in weeks or odstore.week_list(od_dir):
+        os.makedirs(os.path.join(target_dir, week), exist_ok=True)
+        for day, file_path in odstore.day_files(week, od_dir):
+            data = scale_od_day(pd.read_csv(file_path), scale, rng)
+            data.to_csv(os.path.join(target_dir, week, os.path.basename(file_path)), index=False)
+            rows += len(data)
+    return rows
+
+
+def gps(vehicles, minutes=24 * 60, seed=0, day='2014-08-03'):
+    # one point per vehicle and minute: a random walk in the city with occupied and
+    # empty runs, plus a few drift points for the cleaning steps to remove
+    rng = np.random.default_rng(seed)
+    n = vehicles * minutes
+    start_lon = rng.uniform(*LON_RANGE, vehicles)
+    start_lat = rng.uniform(*LAT_RANGE, vehicles)
+    steps = rng.normal(0, 0.002, (2, vehicles, minutes)).cumsum(axis=2)
+    lon = (start_lon[:, None] + steps[0]).clip(*LON_RANGE).ravel()
+    lat = (start_lat[:, None] + steps[1]).clip(*LAT_RANGE).ravel()
+    drift = rng.random(n) < 0.001
+    lon[drift] += rng.choice([-0.5, 0.5], drift.sum())
+    # the status changes on about one minute in twenty
+    status = (rng.random((vehicles, minutes)) < 0.05).cumsum(axis=1) % 2
+    times = pd.Timestamp(day) + pd.to_timedelta(np.tile(np.arange(minutes), vehicles), unit='min')
+    return pd.DataFrame({
+        'VehicleNum': np.repeat(np.arange(vehicles) + 10000, minutes),
+        'Time': times.strftime(TIME_FORMAT),
+        'Lng': lon.round(6),
+        'Lat': lat.round(6),
+        'OpenStatus': status.ravel(),
+        'Speed': rng.integers(0, 60, n),
+    })
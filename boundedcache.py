@@ -0,0 +1,58 @@
+import threading
+from collections import OrderedDict
+
+# 进程内的有界缓存: 超出条目数或字节数上限时，最久未使用的条目先被淘汰
+
+
+class BoundedCache:
+    # Thread-safe least-recently-used cache bounded by the number of entries, the total
+    # size(value) of the entries, or both. The newest entry is always kept, and values
+    # are never None, so get returns None for a miss.
+
+    def __init__(self, max_entries=None, max_size=None, size=len):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self._entry_size = size if max_size is not None else (lambda value: 0)
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        size = self._entry_size(value)
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._sizes[key]
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._sizes[key] = size
+            self._size += size
+            while len(self._entries) > 1 and (
+                    (self.max_entries is not None and len(self._entries) > self.max_entries)
+                    or (self.max_size is not None and self._size > self.max_size)):
+                evicted, _ = self._entries.popitem(last=False)
+                self._size -= self._sizes.pop(evicted)
+        return value
+
+    def get_or_compute(self, key, compute):
+        # compute runs outside the lock, two sessions missing at once may both compute
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, compute())
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._size = 0
+
+    def __len__(self):
+        return len(self._entries)
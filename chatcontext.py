@@ -0,0 +1,119 @@
+import json
+import functools
+import llmcache
+import llm_gateway
+
+# 对话上下文: 最近几轮对话在token预算内原样保留，更早的对话压缩成摘要
+WINDOW_TOKENS = 2000
+SUMMARY_TOKENS = 300
+# turns are folded into the summary in batches until the window is this full again,
+# so the summary model runs every few turns instead of every turn
+REFILL_RATIO = 0.5
+SUMMARY_MODEL = 'gpt-3.5-turbo'
+SUMMARY_PROMPT = ("Summarize the conversation between a user and a data analysis assistant "
+                  "in at most {words} words. Keep the datasets, columns, filters and results "
+                  "that later questions may refer to.")
+
+
+@functools.lru_cache(maxsize=8)
+def get_encoding(model):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding('cl100k_base')
+
+
+def count_tokens(text, model=SUMMARY_MODEL):
+    encoding = get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # without tiktoken: about four ascii characters per token, one token per CJK character
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
+
+def tail_within(text, tokens, model=SUMMARY_MODEL):
+    # the longest end of text within the token budget, characters per token vary too much
+    # between English and Chinese to cut by a fixed ratio
+    shortest, longest = 0, len(text)
+    while shortest < longest:
+        middle = (shortest + longest + 1) // 2
+        if count_tokens(text[len(text) - middle:], model) <= tokens:
+            shortest = middle
+        else:
+            longest = middle - 1
+    return text[len(text) - shortest:]
+
+
+def llm_summarizer(model, key):
+    # summaries are cached by their input, a rerun of the same conversation does not call the model
+    def summarize(summary, turns):
+        messages = [{"role": "system", "content": SUMMARY_PROMPT.format(words=SUMMARY_TOKENS // 2)},
+                    {"role": "user", "content": json.dumps(
+                        {"summary": summary, "turns": turns}, ensure_ascii=False)}]
+        cache = llmcache.get_cache()
+        cache_key = llmcache.make_key(messages[1]['content'], 'summary:' + llm_gateway.resolve_model(model))
+        response = cache.get(cache_key)
+        if response is None:
+            response = llm_gateway.get_gateway().complete(model, messages, key)
+            cache.put(cache_key, response)
+        return response
+    return summarize
+
+
+class ConversationContext:
+    # The part of a conversation sent with each prompt: a rolling summary of the older turns
+    # followed by the most recent turns within a token budget. Each turn is counted once
+    # when it is added, so the cost of a turn does not grow with the length of the chat.
+
+    def __init__(self, window_tokens=WINDOW_TOKENS, summary_tokens=SUMMARY_TOKENS,
+                 model=SUMMARY_MODEL):
+        self.window_tokens = window_tokens
+        self.summary_tokens = summary_tokens
+        self.model = model
+        self.summary = ''
+        self.summary_count = 0
+        # [role, content, tokens] of the turns not yet folded into the summary
+        self.turns = []
+        self.window_count = 0
+
+    def add(self, role, content):
+        tokens = count_tokens(content, self.model)
+        self.turns.append([role, content, tokens])
+        self.window_count += tokens
+
+    def fold(self, summarize=None):
+        # move the oldest turns into the summary once the window is over budget,
+        # the newest turn always stays
+        if self.window_count <= self.window_tokens or len(self.turns) < 2:
+            return
+        folded = []
+        while len(self.turns) > 1 and self.window_count > self.window_tokens * REFILL_RATIO:
+            role, content, tokens = self.turns.pop(0)
+            self.window_count -= tokens
+            folded.append({"role": role, "content": content})
+        if summarize is None:
+            # no model to summarize with, the folded turns are dropped
+            return
+        self.summary = summarize(self.summary, folded)
+        self.summary_count = count_tokens(self.summary, self.model)
+        if self.summary_count > self.summary_tokens:
+            # keep the newest part of an over-long summary
+            self.summary = tail_within(self.summary, self.summary_tokens, self.model)
+            self.summary_count = count_tokens(self.summary, self.model)
+
+    def messages(self, summarize=None):
+        self.fold(summarize)
+        messages = []
+        if self.summary:
+            messages.append({"role": "system",
+                             "content": "Summary of the earlier conversation: " + self.summary})
+        messages.extend({"role": role, "content": content} for role, content, _ in self.turns)
+        return messages
+
+    def tokens(self):
+        return self.summary_count + self.window_count
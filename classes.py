@@ -1,27 +1,54 @@
-from langchain import HuggingFaceHub, LLMChain, PromptTemplate
-from openai import OpenAI
+import llmcache
+import llm_gateway
+import schema
+import spatial
+
+
+def build_messages(question_to_ask, model_type, key, alt_key):
+    task = "Generate Python Code Script.The script should only include plain code!!!, no comments,no markdown, do not user ```."
+    if model_type in llm_gateway.OPENAI_MODELS:
+        return [{"role": "system", "content": task}, {"role": "user", "content": question_to_ask}], key
+    # Hugging Face model
+    return [{"role": "user", "content": question_to_ask}], alt_key
 
 
 def run_request(question_to_ask, model_type, key, alt_key):
-    if model_type == "gpt-4" or model_type == "gpt-3.5-turbo" or model_type == 'gpt-4o':
-        client = OpenAI(api_key=key)
-        # Run OpenAI ChatCompletion API
-        task = "Generate Python Code Script.The script should only include plain code!!!, no comments,no markdown, do not user ```."
-        response = client.chat.completions.create(model=model_type,
-                                                  messages=[{"role": "system", "content": task}, {"role": "user", "content": question_to_ask}])
-        llm_response = response.choices[0].message.content
-    else:
-        # Hugging Face model
-        llm = HuggingFaceHub(huggingfacehub_api_token=alt_key, repo_id="codellama/" +
-                             model_type, model_kwargs={"temperature": 0.1, "max_new_tokens": 500})
-        llm_prompt = PromptTemplate.from_template(question_to_ask)
-        llm_chain = LLMChain(llm=llm, prompt=llm_prompt)
-        llm_response = llm_chain.predict()
+    # Identical questions against the same dataset schema are answered from the cache,
+    # identical questions already in flight share one call in the gateway
+    cache = llmcache.get_cache()
+    cache_key = llmcache.make_key(question_to_ask, llm_gateway.resolve_model(model_type))
+    llm_response = cache.get(cache_key)
+    if llm_response is not None:
+        return llm_response
+    messages, api_key = build_messages(question_to_ask, model_type, key, alt_key)
+    llm_response = llm_gateway.get_gateway().complete(model_type, messages, key=api_key)
     # rejig the response
     llm_response = format_response(llm_response)
+    cache.put(cache_key, llm_response)
     return llm_response
 
 
+def stream_request(question_to_ask, model_type, key, alt_key):
+    # Yields the formatted response received so far, the last value is the complete script
+    # Identical questions against the same dataset schema are answered from the cache
+    cache = llmcache.get_cache()
+    cache_key = llmcache.make_key(question_to_ask, llm_gateway.resolve_model(model_type))
+    llm_response = cache.get(cache_key)
+    if llm_response is not None:
+        yield llm_response
+        return
+    # Run the question through the shared gateway, OpenAI answers arrive token by token
+    messages, api_key = build_messages(question_to_ask, model_type, key, alt_key)
+    llm_response = ""
+    for chunk in llm_gateway.get_gateway().stream(model_type, messages, key=api_key):
+        llm_response += chunk
+        yield format_response(llm_response)
+    # rejig the response
+    llm_response = format_response(llm_response)
+    cache.put(cache_key, llm_response)
+    yield llm_response
+
+
 def format_response(res):
     # Remove the load_csv from the answer if it exists
     csv_line = res.find("read_csv")
@@ -59,23 +86,24 @@ def get_primer(df_dataset, df_name):
     # and the name of the columns
     # and any columns with less than 20 unique values it adds the values to the primer
     # and horizontal grid lines and labeling
-    primer_desc = "Use a dataframe called df from data_file.csv with columns '" \
-        + "','".join(str(x) for x in df_dataset.columns) + "'. "
-    for i in df_dataset.columns:
-        if len(df_dataset[i].drop_duplicates()) < 20 and df_dataset.dtypes[i] == "O":
-            primer_desc = primer_desc + "\nThe column '" + i + "' has categorical values '" + \
-                "','".join(str(x)
-                           for x in df_dataset[i].drop_duplicates()) + "'. "
-        elif df_dataset.dtypes[i] == "int64" or df_dataset.dtypes[i] == "float64":
-            primer_desc = primer_desc + "\nThe column '" + i + "' is type " + \
-                str(df_dataset.dtypes[i]) + " and contains numeric values. "
+    # The column profile is cached per dataset, so repeated questions skip the scan
+    profile = schema.profile_frame(df_dataset)
+    primer_desc = schema.describe_columns(profile)
     primer_desc = primer_desc + "\nLabel the x and y axes appropriately."
     primer_desc = primer_desc + "\nAdd a title. Set the fig suptitle as empty."
     # Space for additional instructions if needed
     primer_desc = primer_desc + \
         "The df is taxi OD data, which contains columns: id(vehicle number),stime,(start time),etime(end time),ID(order id) etc."
-    primer_desc = primer_desc + \
-        "Colmun `etime` and `stime` are string, you need convert them to datetime "
+    if any(column['name'] == "stime" and column['kind'] == 'datetime' for column in profile):
+        # datasets loaded from the OD store already have parsed times
+        primer_desc = primer_desc + \
+            "Colmun `etime` and `stime` are already datetime. "
+    else:
+        primer_desc = primer_desc + \
+            "Colmun `etime` and `stime` are string, you need convert them to datetime "
+    if {'slat', 'slon', 'elat', 'elon'} <= {column['name'] for column in profile}:
+        # the sandbox provides a grid index over the start and end points
+        primer_desc = primer_desc + spatial.HELPER_PROMPT
     primer_desc = primer_desc + \
         "\nUsing Python version 3.11.7, create a script using the dataframe df to graph the following: "
     pimer_code = "import pandas as pd\nimport matplotlib.pyplot as plt\n"
@@ -0,0 +1,419 @@
+import os
+import json
+import math
+import shutil
+import time
+import tempfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import timeparse
+
+# rough size of one raw GPS row, used to size the vehicle buckets of the streaming mode
+ROW_BYTES = 64
+# 并行清洗的默认进程数
+WORKERS = os.cpu_count() or 1
+# 每次清洗的各阶段耗时记录
+RUN_LOG = 'logs/cleaning_runs.jsonl'
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+# tracemalloc is global to the process, runs of concurrent sessions share it
+_trace_lock = threading.Lock()
+_trace_runs = 0
+_trace_owned = False
+
+
+def start_tracing():
+    # the first traced run starts tracemalloc, unless something else already traces
+    global _trace_runs, _trace_owned
+    with _trace_lock:
+        if _trace_runs == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _trace_owned = True
+        _trace_runs += 1
+
+
+def stop_tracing():
+    # and the last one stops it
+    global _trace_runs, _trace_owned
+    with _trace_lock:
+        _trace_runs -= 1
+        if _trace_runs == 0 and _trace_owned:
+            tracemalloc.stop()
+            _trace_owned = False
+
+
+def reset_peak():
+    # the peak is shared too, only a run that traces alone may reset it
+    with _trace_lock:
+        if _trace_runs == 1:
+            tracemalloc.reset_peak()
+
+
+class RunLog:
+    # Per-stage rows in/out, wall time and peak traced memory of one cleaning run.
+    # progress(fraction, stage) is called whenever a stage or a shard/bucket finishes.
+
+    def __init__(self, planned=1, progress=None, trace_memory=True):
+        self.planned = max(planned, 1)
+        self.progress = progress or (lambda fraction, stage: None)
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.started = time.time()
+        self._tracing = False
+
+    @contextmanager
+    def stage(self, name, frame):
+        if self.trace_memory:
+            if not self._tracing:
+                start_tracing()
+                self._tracing = True
+            reset_peak()
+        record = {'stage': name, 'rows_in': len(frame), 'rows_out': len(frame)}
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = round(time.perf_counter() - start, 4)
+            if self.trace_memory:
+                # while other runs trace at the same time this is the peak of the whole
+                # process, an upper bound of the stage's own peak
+                record['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+            self.stages.append(record)
+            self.progress(min(len(self.stages) / self.planned, 1.0), name)
+
+    def add(self, stages, parallel=False):
+        # fold the stage records of a shard or bucket into this run,
+        # shards run side by side so their wall time is the slowest one
+        for record in stages:
+            total = next((r for r in self.stages if r['stage'] == record['stage']), None)
+            if total is None:
+                self.stages.append(dict(record))
+                continue
+            total['rows_in'] += record['rows_in']
+            total['rows_out'] += record['rows_out']
+            if parallel:
+                total['seconds'] = max(total['seconds'], record['seconds'])
+            else:
+                total['seconds'] = round(total['seconds'] + record['seconds'], 4)
+            if 'peak_mb' in record:
+                total['peak_mb'] = max(total.get('peak_mb', 0), record['peak_mb'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # tracing slows every allocation of the server, only keep it on during a run
+        if self._tracing:
+            stop_tracing()
+            self._tracing = False
+
+    def write(self, options, path=RUN_LOG):
+        self.close()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {'time': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+                 'seconds': round(time.time() - self.started, 4),
+                 'options': options, 'stages': self.stages}
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+
+
+def planned_stages(clear_opt, op_opt):
+    stages = ['time']
+    stages += [name for option, name in (('稀疏化', 'sparsify'), ('删除漂移', 'drift'),
+                                          ('删除相同的数据', 'redundant'),
+                                          ('删除瞬时变化', 'status')) if option in clear_opt]
+    if '提取OD' in op_opt or '提取配送和闲置轨迹' in op_opt:
+        stages.append('od')
+    if '提取配送和闲置轨迹' in op_opt:
+        stages.append('trajectory')
+    return stages
+
+
+def sparsify(dataframe, track, timegap):
+    # Keep the first point of every vehicle in each timegap window of a global time grid.
+    # tbd.traj_sparsify buckets by a vehicle number renumbered inside the frame, so its
+    # output changes with the other vehicles in the frame (a shard or a bucket).
+    vehicle, time = track[0], track[1]
+    data = dataframe.drop_duplicates([vehicle, time]).sort_values([vehicle, time], kind='stable')
+    windows = pd.DataFrame({'vehicle': data[vehicle].to_numpy(),
+                            'window': data[time].dt.floor(f'{int(timegap)}s').to_numpy()})
+    return data[~windows.duplicated().to_numpy()]
+
+
+def traj_points(data, oddata, col):
+    # tbd.taxigps_traj_point, except that order ids are only carried forward within a
+    # vehicle. The original fills them across vehicles, so the first idle points of a vehicle
+    # took the last order of whichever vehicle was sorted before it.
+    vehicle, time, lng, lat, status = col
+    starts = oddata[[vehicle, 'stime', 'slon', 'slat', 'ID']].copy()
+    starts.columns = [vehicle, time, lng, lat, 'ID']
+    starts['flag'] = 1
+    starts[status] = -1
+    ends = oddata[[vehicle, 'etime', 'elon', 'elat', 'ID']].copy()
+    ends.columns = [vehicle, time, lng, lat, 'ID']
+    ends['flag'] = -1
+    ends[status] = -1
+    points = pd.concat([data, starts, ends]).sort_values(by=[vehicle, time, status],
+                                                          kind='stable')
+    points['flag'] = points['flag'].fillna(0)
+    points['flag'] = points.groupby(vehicle)['flag'].cumsum()
+    points['ID'] = points.groupby(vehicle)['ID'].ffill()
+    trip_point = points['ID'].notnull() & (points[status] != -1)
+    return points[(points['flag'] == 1) & trip_point], points[(points['flag'] == 0) & trip_point]
+
+
+def run_steps(dataframe, cols, clear_opt, op_opt, time_gap=None, notify=None, warn=None,
+              log=None):
+    # Run the selected cleaning and extraction steps on one frame.
+    # cols maps id/time/lon/lat/status to column names, status may be None.
+    # notify(text) reports the current step, warn(exception) a failed step which is skipped,
+    # log (a RunLog) records every stage.
+    # transbigdata (with geopandas) takes seconds to import, only load it once a run starts
+    import transbigdata as tbd
+    notify = notify or (lambda text: None)
+    warn = warn or (lambda e: None)
+    log = log or RunLog(trace_memory=False)
+    track = [cols['id'], cols['time'], cols['lon'], cols['lat']]
+    results = {}
+
+    notify('转换时间格式中')
+    with log.stage('time', dataframe) as stage:
+        try:
+            dataframe[cols['time']] = timeparse.parse(dataframe[cols['time']])
+        except (TypeError, ValueError) as e:
+            warn(e)
+
+    if '稀疏化' in clear_opt:
+        notify('开始轨迹稀疏化...')
+        with log.stage('sparsify', dataframe) as stage:
+            try:
+                dataframe = sparsify(dataframe, track, time_gap or 60*60)
+            except Exception as e:
+                warn(e)
+            stage['rows_out'] = len(dataframe)
+
+    if '删除漂移' in clear_opt:
+        # 删除轨迹数据中的漂移。
+        notify('删除轨迹数据中的漂移')
+        with log.stage('drift', dataframe) as stage:
+            try:
+                dataframe = tbd.traj_clean_drift(
+                    dataframe, col=track, method='twoside', speedlimit=80, dislimit=1000)
+            except Exception as e:
+                warn(e)
+            stage['rows_out'] = len(dataframe)
+
+    if '删除相同的数据' in clear_opt:
+        notify('删除与前后数据信息相同的数据')
+        with log.stage('redundant', dataframe) as stage:
+            try:
+                dataframe = tbd.traj_clean_redundant(dataframe, col=track)
+            except Exception as e:
+                warn(e)
+            stage['rows_out'] = len(dataframe)
+
+    if '删除瞬时变化' in clear_opt:
+        notify('从出租车数据中删除乘客携带状态的瞬时变化记录')
+        with log.stage('status', dataframe) as stage:
+            try:
+                dataframe = tbd.clean_taxi_status(
+                    dataframe, col=[cols['id'], cols['time'], cols['status']], timelimit=None)
+            except Exception as e:
+                warn(e)
+            stage['rows_out'] = len(dataframe)
+    results['clear_data'] = dataframe
+
+    if '提取OD' in op_opt or '提取配送和闲置轨迹' in op_opt:
+        notify('提取OD信息')
+        with log.stage('od', dataframe) as stage:
+            try:
+                results['oddata'] = tbd.taxigps_to_od(dataframe, col=track + [cols['status']])
+                stage['rows_out'] = len(results['oddata'])
+            except Exception as e:
+                warn(e)
+                stage['rows_out'] = 0
+
+    if '提取配送和闲置轨迹' in op_opt:
+        notify('提取配送和闲置行程的轨迹点')
+        with log.stage('trajectory', dataframe) as stage:
+            stage['rows_out'] = 0
+            try:
+                if 'oddata' in results:
+                    results['data_deliver'], results['data_idle'] = traj_points(
+                        dataframe, results['oddata'], col=track + [cols['status']])
+                    stage['rows_out'] = len(results['data_deliver']) + len(results['data_idle'])
+            except Exception as e:
+                warn(e)
+    return results
+
+
+def offset_ids(results, od_count):
+    # order ids restart in every partition, shift them to stay unique across the merged output
+    for name in ('oddata', 'data_deliver', 'data_idle'):
+        if name in results:
+            results[name] = results[name].assign(ID=results[name]['ID'] + od_count)
+    return od_count + len(results.get('oddata', ()))
+
+
+def renumber_orders(results):
+    # Number the orders of the merged output in vehicle order, as a single run does.
+    # The trajectory points follow their orders.
+    if 'oddata' not in results:
+        return
+    numbers = pd.Series(range(len(results['oddata'])), index=results['oddata']['ID'].to_numpy())
+    results['oddata'] = results['oddata'].assign(ID=numbers.to_numpy())
+    for name in ('data_deliver', 'data_idle'):
+        if name in results:
+            results[name] = results[name].assign(
+                ID=numbers.reindex(results[name]['ID'].to_numpy()).to_numpy())
+
+
+def run_shard(shard, cols, clear_opt, op_opt, time_gap, trace_memory):
+    # worker side of parallel_steps, failed steps are reported back as text
+    warnings = []
+    log = RunLog(trace_memory=trace_memory)
+    results = run_steps(shard, cols, clear_opt, op_opt, time_gap,
+                        warn=warnings.append, log=log)
+    log.close()
+    return results, [str(e) for e in warnings], log.stages
+
+
+def get_pool(workers):
+    # worker processes import transbigdata on their first shard and are reused across runs
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=workers,
+                                        mp_context=multiprocessing.get_context('spawn'))
+            _pool_workers = workers
+        return _pool
+
+
+def parallel_steps(dataframe, cols, clear_opt, op_opt, time_gap=None, workers=WORKERS,
+                   notify=None, warn=None, log=None):
+    # Every step works per vehicle (sparsify and traj_points are the per-vehicle versions
+    # of their tbd counterparts), so shard the frame by vehicle, run the chain on the
+    # shards in a process pool and concatenate the results in vehicle order.
+    notify = notify or (lambda text: None)
+    warn = warn or (lambda e: None)
+    log = log or RunLog(trace_memory=False)
+    # the run stops tracing memory even when a step raises
+    with log:
+        shards = min(workers, dataframe[cols['id']].nunique())
+        if shards <= 1:
+            log.planned = len(planned_stages(clear_opt, op_opt))
+            return run_steps(dataframe, cols, clear_opt, op_opt, time_gap, notify, warn, log)
+        notify(f'按车辆分为{shards}份并行处理')
+        codes = pd.factorize(dataframe[cols['id']])[0] % shards
+        parts = [part for _, part in dataframe.groupby(codes)]
+        pool = get_pool(workers)
+        futures = [pool.submit(run_shard, part, cols, clear_opt, op_opt, time_gap,
+                               log.trace_memory)
+                   for part in parts]
+        merged = {}
+        od_count = 0
+        for i, future in enumerate(futures):
+            results, warnings, stages = future.result()
+            for message in dict.fromkeys(warnings):
+                warn(message)
+            log.add(stages, parallel=True)
+            log.progress((i + 1) / len(futures), f'shard {i + 1}/{len(futures)}')
+            od_count = offset_ids(results, od_count)
+            for name, frame in results.items():
+                merged.setdefault(name, []).append(frame)
+        # a stable sort by vehicle keeps each vehicle's rows in the order its shard produced them
+        with log.stage('merge', dataframe) as stage:
+            merged = {name: pd.concat(frames).sort_values(cols['id'], kind='stable')
+                      for name, frames in merged.items()}
+            renumber_orders(merged)
+            stage['rows_out'] = len(merged.get('clear_data', ()))
+        return merged
+
+
+def bucket_count(total_bytes, chunksize):
+    # enough buckets that one bucket is about the size of one chunk
+    return max(1, math.ceil(total_bytes / (chunksize * ROW_BYTES)))
+
+
+def partition_by_vehicle(source, id_col, buckets, chunksize, work_dir, encoding=None):
+    # Pass 1: split the input into bucket files by a hash of the vehicle id, so every
+    # bucket holds whole trajectories no matter how the input is ordered.
+    paths = [os.path.join(work_dir, f'bucket_{i}.csv') for i in range(buckets)]
+    rows = 0
+    for chunk in pd.read_csv(source, encoding=encoding, chunksize=chunksize):
+        rows += len(chunk)
+        keys = pd.util.hash_pandas_object(chunk[id_col].astype(str), index=False) % buckets
+        for key, part in chunk.groupby(keys.to_numpy()):
+            path = paths[key]
+            part.to_csv(path, mode='a', header=not os.path.exists(path), index=False)
+    return [path for path in paths if os.path.exists(path)], rows
+
+
+def append_csv(frame, path):
+    frame.to_csv(path, mode='a', header=not os.path.exists(path), index=False)
+
+
+def stream_clean(source, cols, clear_opt, op_opt, time_gap=None, encoding=None,
+                 chunksize=500000, total_bytes=None, out_dir=None, notify=None, warn=None,
+                 log=None):
+    # Streaming mode for inputs larger than memory: read the input in chunks, partition it
+    # by vehicle, then clean one bucket at a time and append the results to csv files.
+    # Peak memory follows the bucket size instead of the file size.
+    notify = notify or (lambda text: None)
+    log = log or RunLog(trace_memory=False)
+    created = out_dir is None
+    out_dir = out_dir or tempfile.mkdtemp(prefix='cleaning_')
+    # the run stops tracing memory even when a step raises
+    with log:
+        buckets = bucket_count(total_bytes, chunksize) if total_bytes else 1
+        outputs = {}
+        od_count = 0
+        work = tempfile.TemporaryDirectory(dir=out_dir)
+        try:
+            work_dir = work.name
+            notify('按车辆分块读取数据')
+            with log.stage('partition', ()) as stage:
+                paths, rows = partition_by_vehicle(source, cols['id'], buckets, chunksize,
+                                                   work_dir, encoding)
+                stage['rows_in'] = stage['rows_out'] = rows
+            for i, path in enumerate(paths):
+                bucket = pd.read_csv(path)
+                with RunLog(trace_memory=log.trace_memory) as bucket_log:
+                    results = run_steps(
+                        bucket, cols, clear_opt, op_opt, time_gap,
+                        notify=lambda text: notify(f'[{i + 1}/{len(paths)}] {text}'),
+                        warn=warn, log=bucket_log)
+                log.add(bucket_log.stages)
+                log.progress((i + 1) / len(paths), f'bucket {i + 1}/{len(paths)}')
+                od_count = offset_ids(results, od_count)
+                for name, frame in results.items():
+                    outputs[name] = os.path.join(out_dir, name + '.csv')
+                    append_csv(frame, outputs[name])
+        except BaseException:
+            # a failed run leaves nothing behind in a directory it created
+            if created:
+                shutil.rmtree(out_dir, ignore_errors=True)
+            raise
+        finally:
+            work.cleanup()
+        if created and not outputs:
+            shutil.rmtree(out_dir, ignore_errors=True)
+        return outputs
+
+
+def remove_outputs(results):
+    # a streamed run writes its files to its own directory, removed once the results are replaced
+    for path in {os.path.dirname(path) for path in results.values() if isinstance(path, str)}:
+        shutil.rmtree(path, ignore_errors=True)
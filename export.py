@@ -0,0 +1,76 @@
+import io
+import os
+import gzip
+import shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from schema import content_hash
+from boundedcache import BoundedCache
+
+# 下载格式: 名称 -> (扩展名, mime)
+FORMATS = {
+    'CSV': ('.csv', 'text/csv'),
+    'CSV (gzip)': ('.csv.gz', 'application/gzip'),
+    'Parquet (zstd)': ('.parquet', 'application/vnd.apache.parquet'),
+}
+# 进程内缓存的序列化结果上限
+MAX_BYTES = 512 * 1024 ** 2
+# rows per batch when converting a streamed csv result
+CHUNK_ROWS = 500000
+
+_artifacts = BoundedCache(max_size=MAX_BYTES)
+
+
+def to_bytes(frame, fmt):
+    buffer = io.BytesIO()
+    if fmt == 'CSV':
+        frame.to_csv(buffer, index=False, encoding='utf-8')
+    elif fmt == 'CSV (gzip)':
+        frame.to_csv(buffer, index=False, encoding='utf-8', compression='gzip')
+    else:
+        frame.to_parquet(buffer, index=False, compression='zstd')
+    return buffer.getvalue()
+
+
+def serialize(frame, fmt):
+    # serialized artifacts are shared by every session and evicted least recently used first
+    return _artifacts.get_or_compute((content_hash(frame), fmt), lambda: to_bytes(frame, fmt))
+
+
+def convert_file(path, fmt):
+    # Results of the streaming mode are csv files on disk, convert them batch by batch
+    # next to the source. The converted file is reused while the source is unchanged.
+    if fmt == 'CSV':
+        return path
+    target = path[:-len('.csv')] + FORMATS[fmt][0]
+    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+        return target
+    if fmt == 'CSV (gzip)':
+        with open(path, 'rb') as source, gzip.open(target + '.tmp', 'wb') as output:
+            shutil.copyfileobj(source, output)
+    else:
+        writer = None
+        try:
+            for chunk in pd.read_csv(path, chunksize=CHUNK_ROWS):
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(target + '.tmp', table.schema, compression='zstd')
+                writer.write_table(table.cast(writer.schema))
+        finally:
+            if writer is not None:
+                writer.close()
+        if writer is None:
+            # header only
+            pd.read_csv(path, nrows=0).to_parquet(target + '.tmp', index=False)
+    os.replace(target + '.tmp', target)
+    return target
+
+
+def prepare(result, fmt):
+    # data for st.download_button: the bytes of an in-memory frame or of a streamed result's
+    # file, the button reads a file object into memory all the same
+    if isinstance(result, str):
+        with open(convert_file(result, fmt), 'rb') as f:
+            return f.read()
+    return serialize(result, fmt)
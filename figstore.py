@@ -0,0 +1,34 @@
+import hashlib
+import threading
+from boundedcache import BoundedCache
+
+# 渲染好的图片按内容哈希存放，聊天记录只保存哈希
+MAX_BYTES = 256 * 1024 ** 2
+
+
+class FigureStore:
+    # content-addressed image bytes with least-recently-used eviction over a byte budget
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._images = BoundedCache(max_size=max_bytes)
+
+    def put(self, image):
+        digest = hashlib.sha256(image).hexdigest()
+        self._images.put(digest, image)
+        return digest
+
+    def get(self, digest):
+        return self._images.get(digest)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = FigureStore()
+        return _store
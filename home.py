@@ -1,8 +1,16 @@
+import startup
+startup.page_started('home')
 import pydeck as pdk
 import pandas as pd
-import os
 import streamlit as st
+import odstore
+import odagg
+import spatial
+import odflow
 from millify import millify
+# 服务启动后第一次运行时在后台预加载分区、汇总表和索引
+startup.start()
+startup.mark('home', 'imports')
 # page config
 st.set_page_config(
     page_title="出租车数据仪表盘",
@@ -11,58 +19,129 @@ st.set_page_config(
     initial_sidebar_state="expanded")
 
 
-@st.cache_resource
-# 放入缓存
-def load_data(subdirectory):
-    # 初始化一个空的DataFrame用于存储数据
-    merged_data = pd.DataFrame()
+@st.cache_resource(max_entries=8)
+# 放入缓存，version变化(有新的或修改过的每日文件)时重新读取
+def load_data(start, end, version):
+    # 从列式存储中只读取时间范围内的每日分区，首次访问时会把每日的txt文件转换一次
+    return odstore.load_range(start, end)
 
-    # 遍历所选子目录下的所有文件
-    for filename in os.listdir(subdirectory):
-        file_path = os.path.join(subdirectory, filename)
-        # 检查文件是否为txt文件
-        if file_path.endswith('.txt'):
-            # 尝试读取文件数据，并合并到已有数据中
-            try:
-                data = pd.read_csv(file_path)
-                merged_data = pd.concat([merged_data, data], ignore_index=True)
-            except Exception as e:
-                print(f"Error processing file {file_path}: {e}")
-    return merged_data
 
+@st.cache_resource(max_entries=16)
+def load_summary(start, end, version):
+    # 预聚合的每日每车统计，指标卡片只读取这些小表
+    return odstore.load_range_summary(start, end)
 
+
+day_index = odstore.day_index()
+first_date, last_date = day_index[0][0], day_index[-1][0]
 with st.sidebar:
     st.sidebar.title('出租车数据仪表盘')
-    week_list = ['week1', 'week2', 'week3', 'week4']
-    selected_week = st.selectbox('周选择', week_list)
+    range_mode = st.radio('时间范围', ['周', '日', '最近7天', '整月', '自定义'], horizontal=True)
+    if range_mode == '周':
+        week_list = odstore.week_list()
+        selected_week = st.selectbox('周选择', week_list)
+        week_dates = [date for date, week, _ in day_index if week == selected_week]
+        start, end = week_dates[0], week_dates[-1]
+    elif range_mode == '日':
+        start = end = pd.Timestamp(st.date_input(
+            '日期', value=first_date, min_value=first_date, max_value=last_date))
+    elif range_mode == '最近7天':
+        # 截止到所选日期的7天
+        end = pd.Timestamp(st.date_input(
+            '截止日期', value=last_date, min_value=first_date, max_value=last_date))
+        start = end - pd.Timedelta(days=6)
+    elif range_mode == '整月':
+        month_list = sorted({date.to_period('M') for date, _, _ in day_index})
+        selected_month = st.selectbox('月份', month_list, format_func=str)
+        start, end = selected_month.start_time, selected_month.end_time.normalize()
+    else:
+        selected_range = st.date_input('日期范围', value=(first_date, last_date),
+                                       min_value=first_date, max_value=last_date)
+        # 只选了开始日期时先按一天计算
+        start = pd.Timestamp(selected_range[0])
+        end = pd.Timestamp(selected_range[-1])
     color_theme_list = ['blues', 'cividis', 'greens', 'inferno',
                         'magma', 'plasma', 'reds', 'rainbow', 'turbo', 'viridis']
     selected_color_theme = st.selectbox(
         '主题', color_theme_list)
-# 选择对应的子目录
-    subdirectory = os.path.join('static/1000taxidata/odddata', selected_week)
+# 与之前等长的时间段比较
+pre_start, pre_end = odstore.previous_period(start, end)
+# 只检查文件的mtime和大小，新增的每日文件会被增量导入
+range_version = odstore.ingest_range(start, end)
+if not odstore.select_days(start, end):
+    st.warning('所选时间范围内没有数据')
+    st.stop()
 
 
-def make_scattermap():
-    merged_data = load_data(subdirectory)
-    s_data = merged_data[['slat', 'slon']]
-    e_data = merged_data[['elat', 'elon']]
-    s_data.rename(columns={'slat': 'lat', 'slon': 'lon'}, inplace=True)
-    e_data.rename(columns={'elat': 'lat', 'elon': 'lon'}, inplace=True)
-    radius = st.slider('半径', 1, 20, 5)
+@st.cache_resource(max_entries=8)
+def load_points(start, end, version):
+    # 起点和终点坐标只在每个时间范围第一次访问时切片一次
+    merged_data = load_data(start, end, version)
+    s_data = merged_data[['slat', 'slon']].rename(
+        columns={'slat': 'lat', 'slon': 'lon'})
+    e_data = merged_data[['elat', 'elon']].rename(
+        columns={'elat': 'lat', 'elon': 'lon'})
+    return s_data, e_data
 
-    st.pydeck_chart(pdk.Deck(
-        initial_view_state=pdk.ViewState(
-            latitude=30.659462,
-            longitude=104.065735,
-            zoom=11,
-            pitch=0,
-            bearing=0,
-            max_zoom=16
-        ),
 
-        map_style='https://basemaps.cartocdn.com/gl/positron-nolabels-gl-style/style.json',
-        layers=[
+@st.cache_resource(max_entries=8)
+def load_index(start, end, version):
+    # 起点和终点的网格索引，由每天保存的索引合并而成
+    return odstore.load_range_index(start, end)
+
+
+@st.cache_data
+def load_bins(start, end, version, zoom):
+    # 在服务端按网格聚合起点和终点，浏览器只接收每个格子的计数
+    s_data, e_data = load_points(start, end, version)
+    size = spatial.cell_size(zoom)
+    return spatial.bin_points(s_data['lat'], s_data['lon'], size), \
+        spatial.bin_points(e_data['lat'], e_data['lon'], size), size
+
+
+def make_scattermap():
+    map_mode = st.radio('显示方式', ['网格聚合', '原始点', '热点'], horizontal=True)
+    center_lat, center_lon = spatial.REF_LAT, 104.065735
+    tooltip = True
+    if map_mode == '网格聚合':
+        zoom = st.slider('缩放级别', 9, 14, 11)
+        s_bins, e_bins, size = load_bins(start, end, range_version, zoom)
+        tooltip = {'text': '{count}'}
+        layers = [
+            pdk.Layer(
+                'GridCellLayer',
+                data=s_bins,
+                get_position='[lon, lat]',
+                cell_size=size,
+                pickable=True,
+                extruded=False,
+                get_fill_color='[255, 0, 128, 40 + 215 * weight]',
+            ),
+            pdk.Layer(
+                'GridCellLayer',
+                data=e_bins,
+                get_position='[lon, lat]',
+                cell_size=size,
+                pickable=True,
+                extruded=False,
+                get_fill_color='[0, 128, 255, 40 + 215 * weight]',
+            )
+        ]
+    elif map_mode == '原始点':
+        # 只发送视野范围内的点: 视野由这里的中心和缩放决定，地图的初始视角也用它们，
+        # 拖动地图不会重新查询，需要修改中心坐标
+        view_cols = st.columns(3)
+        center_lat = view_cols[0].number_input('中心纬度', value=center_lat, format='%.6f')
+        center_lon = view_cols[1].number_input('中心经度', value=center_lon, format='%.6f')
+        with view_cols[2]:
+            zoom = st.slider('缩放级别', 9, 16, 11)
+        s_data, e_data = load_points(start, end, range_version)
+        index = load_index(start, end, range_version)
+        bbox = spatial.viewport_bbox(center_lat, center_lon, zoom)
+        s_data = s_data.iloc[index['start'].bbox(*bbox)]
+        e_data = e_data.iloc[index['end'].bbox(*bbox)]
+        radius = st.slider('半径', 1, 20, 5)
+        layers = [
             pdk.Layer(
                 'ScatterplotLayer',
                 data=s_data,
@@ -84,55 +163,144 @@ def make_scattermap():
                 get_radius=radius,
             )
         ]
+    else:
+        zoom = 12
+        index = load_index(start, end, range_version)
+        hot_cols = st.columns(3)
+        point = hot_cols[0].radio('位置', ['起点', '终点'], horizontal=True)
+        point = 'start' if point == '起点' else 'end'
+        k = hot_cols[1].slider('热点数量', 5, 50, 10)
+        size = hot_cols[2].select_slider('格子大小(米)', [250, 500, 1000, 2000], 500)
+        hotspots = index[point].hotspots(k, size)
+        hotspots['weight'] = hotspots['count'] / hotspots['count'].max()
+        # 以地图中心为圆心的半径查询
+        query_cols = st.columns(3)
+        query_lat = query_cols[0].number_input('纬度', value=center_lat, format='%.6f')
+        query_lon = query_cols[1].number_input('经度', value=center_lon, format='%.6f')
+        meters = query_cols[2].slider('查询半径(米)', 100, 3000, 500, step=100)
+        with query_cols[0]:
+            st.metric('半径内上车数', millify(index['start'].count_radius(query_lat, query_lon, meters)))
+        with query_cols[1]:
+            st.metric('半径内下车数', millify(index['end'].count_radius(query_lat, query_lon, meters)))
+        tooltip = {'text': '{count}'}
+        layers = [
+            pdk.Layer(
+                'ScatterplotLayer',
+                data=hotspots,
+                get_position='[lon, lat]',
+                pickable=True,
+                opacity=0.6,
+                get_color='[255, 0, 128, 60 + 195 * weight]',
+                get_radius=size / 2,
+            ),
+            pdk.Layer(
+                'ScatterplotLayer',
+                data=pd.DataFrame({'lat': [query_lat], 'lon': [query_lon]}),
+                get_position='[lon, lat]',
+                stroked=True,
+                filled=False,
+                get_line_color='[0, 128, 255]',
+                line_width_min_pixels=2,
+                get_radius=meters,
+            )
+        ]
+
+    st.pydeck_chart(pdk.Deck(
+        initial_view_state=pdk.ViewState(
+            latitude=center_lat,
+            longitude=center_lon,
+            zoom=zoom,
+            pitch=0,
+            bearing=0,
+            max_zoom=16
+        ),
+
+        map_style='https://basemaps.cartocdn.com/gl/positron-nolabels-gl-style/style.json',
+        layers=layers,
+        tooltip=tooltip
+    ))
+    if map_mode == '热点':
+        st.dataframe(hotspots[['lat', 'lon', 'count']], hide_index=True,
+                     use_container_width=True)
+
+
+@st.cache_data(max_entries=32)
+def load_flows(start, end, version, period, size):
+    # 区与区之间的行程数，由每天的小时流量表合并
+    return odflow.range_flows(start, end, period, size)
+
+
+def make_flowmap():
+    flow_cols = st.columns(3)
+    periods = {'全部': None, '按周': 'week', '按天': 'day', '按小时': 'hour'}
+    period = periods[flow_cols[0].selectbox('时间粒度', list(periods))]
+    size = flow_cols[1].select_slider('分区大小(米)', [500, 1000, 2000, 3000], 1000)
+    n = flow_cols[2].slider('显示的OD对数量', 50, 1000, 200, step=50)
+    flows = load_flows(start, end, range_version, period, size)
+    if period == 'hour':
+        # 按小时时选择一天中的小时，合并范围内的每一天
+        hour = st.slider('小时', 0, 23, 8)
+        flows = flows[flows['period'].dt.hour == hour]
+    elif period is not None:
+        period_list = sorted(flows['period'].unique())
+        if len(period_list) > 1:
+            selected_period = st.select_slider(
+                '时间段', period_list, format_func=lambda x: pd.Timestamp(x).strftime('%m-%d'))
+            flows = flows[flows['period'] == selected_period]
+    pairs = odflow.top_flows(flows, n, size)
+    if pairs.empty:
+        st.info('没有跨区的行程')
+        return
+    pairs['weight'] = pairs['trips'] / pairs['trips'].max()
+    st.pydeck_chart(pdk.Deck(
+        initial_view_state=pdk.ViewState(
+            latitude=spatial.REF_LAT,
+            longitude=104.065735,
+            zoom=10,
+            pitch=40,
+            bearing=0,
+            max_zoom=16
+        ),
+        map_style='https://basemaps.cartocdn.com/gl/positron-nolabels-gl-style/style.json',
+        layers=[pdk.Layer(
+            'ArcLayer',
+            data=pairs,
+            get_source_position='[slon, slat]',
+            get_target_position='[elon, elat]',
+            get_source_color='[255, 0, 128, 80 + 175 * weight]',
+            get_target_color='[0, 128, 255, 80 + 175 * weight]',
+            get_width='1 + 6 * weight',
+            pickable=True,
+        )],
+        tooltip={'text': '{trips}'}
     ))
 
 
 col = st.columns((1.5, 4.5, 2), gap='medium')
 with col[0]:
     st.markdown('#### 收益/损失')
-    data = load_data(subdirectory)
-    selected_index = week_list.index(selected_week)
-    previous_index = (selected_index - 1) % len(week_list)  # 获取上一周的索引
-    previous_week = week_list[previous_index]  # 获取上一周的名称
-    pre_subdirectory = os.path.join(
-        'static/1000taxidata/odddata', previous_week)
-    pre_data = load_data(pre_subdirectory)
-
-    pre_num_records = len(pre_data)
-    num_records = len(data)
+    summary = load_summary(start, end, range_version)
+    pre_summary = load_summary(
+        pre_start, pre_end, odstore.ingest_range(pre_start, pre_end))
+    # 之前的时间段没有数据时不显示变化
+    has_previous = not pre_summary.empty
 
+    num_records = odagg.total_orders(summary)
     with st.container(border=True):
         st.metric(label="订单总数", value=millify(num_records),
-                  delta=millify(num_records - pre_num_records))
-
-    # 将 'stime' 和 'etime' 列转换为日期时间类型
-    data['stime'] = pd.to_datetime(data['stime'])
-    data['etime'] = pd.to_datetime(data['etime'])
-    pre_data['stime'] = pd.to_datetime(pre_data['stime'])
-    pre_data['etime'] = pd.to_datetime(pre_data['etime'])
-    # 计算每辆出租车的行程持续时间
-    data['duration'] = (data['etime'] - data['stime']
-                        ).dt.total_seconds() / 3600
-    pre_data['duration'] = (pre_data['etime'] - pre_data['stime']
-                            ).dt.total_seconds() / 3600
-    # 其余部分不变
-    total_working_hours = 18  # 总工作时间为18小时
-
-    total_trip_duration = data.groupby('id')['duration'].sum()
-    pre_total_trip_duration = pre_data.groupby('id')['duration'].sum()
-    utilization_rate = total_trip_duration / total_working_hours
-    pre_utilization_rate = pre_total_trip_duration / total_working_hours
+                  delta=millify(num_records - odagg.total_orders(pre_summary))
+                  if has_previous else None)
+
+    utilization_rate = odagg.utilization(summary)
     # 输出利用率
     with st.container(border=True):
-        st.metric(label="利用率", value=str(round(utilization_rate.mean()*100))+'%',
-                  delta=str(round(utilization_rate.mean()*100 - pre_utilization_rate.mean()*100))+'%')
-
-    # 首先，将时间列转换为日期，以便按天进行分组
-    data['date'] = pd.to_datetime(data['stime']).dt.date
+        st.metric(label="利用率", value=str(round(utilization_rate*100))+'%',
+                  delta=str(round(utilization_rate*100 - odagg.utilization(pre_summary)*100))+'%'
+                  if has_previous else None)
 
-    # 然后，按日期进行分组并计算每天的订单数
-    daily_orders = data.groupby('date').size().reset_index(name='orders')
-    order_list = daily_orders['orders'].to_list()
+    # 按日期计算每天的订单数
+    daily_orders = odagg.daily_orders(summary)
+    order_list = daily_orders.to_list()
     order_df = pd.DataFrame(
         {
             'orders': [order_list]
@@ -145,7 +313,7 @@ with col[0]:
                 "订单数(每天)",
                 width="medium",
                 help="The sales volume in the last 6 months",
-                y_min=30000,
+                y_min=min(order_list),
                 y_max=max(order_list),
             ),
         },
@@ -156,10 +324,11 @@ with col[0]:
 with col[1]:
     st.markdown('#### 乘客目的地和热门地点')
     make_scattermap()
+    st.markdown('#### OD流量')
+    make_flowmap()
 with col[2]:
     st.markdown('#### Top States')
-    df_groupby_id = data.groupby('id').size().sort_values(
-        ascending=False).reset_index(name='orders')
+    df_groupby_id = odagg.top_vehicles(summary)
     st.dataframe(df_groupby_id,
                  column_order=("id", "orders"),
                  hide_index=True,
@@ -180,5 +349,9 @@ with col[2]:
     with st.expander('About', expanded=True):
         st.write('''
             - 数据来源: 成都2014八月出租车数据,随机抽取1000辆出租车
-            - :orange[**收入/损失**]: 以周计，订单总数是这一周1000辆出租车的总订单数，以及较上周的数据浮动情况，:green[**绿色**]表示上升，:red[**红色**]表示下降.
+            - :orange[**收入/损失**]: 订单总数是所选时间范围内1000辆出租车的总订单数，以及较之前等长时间段的数据浮动情况，:green[**绿色**]表示上升，:red[**红色**]表示下降.
             ''')
+
+startup.mark('home', 'first_paint')
+with st.sidebar.expander('启动耗时', expanded=False):
+    st.json(startup.report())
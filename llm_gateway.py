@@ -0,0 +1,185 @@
+import os
+import json
+import queue
+import random
+import asyncio
+import hashlib
+import threading
+
+# 所有页面共享的模型调用层
+OPENAI_MODELS = ('gpt-4', 'gpt-3.5-turbo', 'gpt-4o')
+# a local backend that answers without any network call, for testing,
+# LLM_BACKEND=stub routes every model to it
+STUB_MODEL = 'stub'
+# 每个模型同时进行的请求数
+CONCURRENCY = {'gpt-4': 4, 'gpt-4o': 8, 'gpt-3.5-turbo': 8}
+DEFAULT_CONCURRENCY = 2
+RETRIES = 3
+BACKOFF_SECONDS = 1.0
+TIMEOUT_SECONDS = 120
+
+STUB_RESPONSE = "df.iloc[:, 0].value_counts().head(20).plot(kind='bar', ax=ax)\n"
+
+
+def resolve_model(model):
+    return STUB_MODEL if os.environ.get('LLM_BACKEND') == STUB_MODEL else model
+
+
+def retryable(e):
+    # rate limits, dropped connections, timeouts and server errors are worth another try
+    try:
+        from openai import RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+    except ImportError:
+        return isinstance(e, (ConnectionError, TimeoutError))
+    return isinstance(e, (RateLimitError, APIConnectionError, APITimeoutError,
+                          InternalServerError, ConnectionError, TimeoutError))
+
+
+class Gateway:
+    # Runs every model call on one background event loop, so sessions share pooled HTTP
+    # connections. Requests are limited per model, identical in-flight requests are
+    # coalesced into one call, and transient failures are retried with backoff.
+
+    def __init__(self, stub_response=STUB_RESPONSE):
+        self.stub_response = stub_response
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        name='llm-gateway', daemon=True)
+        self._thread.start()
+        self._clients = {}
+        self._chains = {}
+        self._chat_models = {}
+        self._semaphores = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _openai_client(self, key):
+        # one AsyncOpenAI client per api key keeps its connection pool alive
+        client = self._clients.get(key)
+        if client is None:
+            from openai import AsyncOpenAI
+            client = self._clients[key] = AsyncOpenAI(api_key=key, max_retries=0)
+        return client
+
+    def _hf_chain(self, model, key):
+        chain = self._chains.get((model, key))
+        if chain is None:
+            from langchain import HuggingFaceHub, LLMChain, PromptTemplate
+            llm = HuggingFaceHub(huggingfacehub_api_token=key, repo_id="codellama/" +
+                                 model, model_kwargs={"temperature": 0.1, "max_new_tokens": 500})
+            chain = LLMChain(llm=llm, prompt=PromptTemplate.from_template("{question}"))
+            self._chains[(model, key)] = chain
+        return chain
+
+    def chat_model(self, model, key, **kwargs):
+        # langchain chat model for the agent pages, reused across prompts and sessions
+        cache_key = (model, key, tuple(sorted(kwargs.items())))
+        with self._lock:
+            llm = self._chat_models.get(cache_key)
+            if llm is None:
+                from langchain_community.chat_models import ChatOpenAI
+                llm = ChatOpenAI(model=model, openai_api_key=key, **kwargs)
+                self._chat_models[cache_key] = llm
+            return llm
+
+    def _semaphore(self, model):
+        semaphore = self._semaphores.get(model)
+        if semaphore is None:
+            semaphore = self._semaphores[model] = asyncio.Semaphore(
+                CONCURRENCY.get(model, DEFAULT_CONCURRENCY))
+        return semaphore
+
+    async def _retry(self, call):
+        for attempt in range(RETRIES + 1):
+            try:
+                return await call()
+            except Exception as e:
+                if attempt == RETRIES or not retryable(e):
+                    raise
+                await asyncio.sleep(BACKOFF_SECONDS * 2 ** attempt * (0.5 + random.random()))
+
+    async def _call(self, model, messages, key):
+        if model == STUB_MODEL:
+            return self.stub_response
+        if model in OPENAI_MODELS:
+            response = await self._openai_client(key).chat.completions.create(
+                model=model, messages=messages)
+            return response.choices[0].message.content
+        # Hugging Face model, the langchain client is synchronous
+        chain = self._hf_chain(model, key)
+        question = "\n".join(message['content'] for message in messages
+                             if message['role'] == 'user')
+        return await self._loop.run_in_executor(None, lambda: chain.predict(question=question))
+
+    async def acomplete(self, model, messages, key=None):
+        # only requests on the same api key are coalesced, each user pays for and sees
+        # the errors of their own key
+        key_hash = hashlib.sha256((key or '').encode()).hexdigest()
+        request_key = hashlib.sha256(json.dumps([model, messages, key_hash]).encode()).hexdigest()
+        future = self._inflight.get(request_key)
+        if future is not None:
+            # the same request is already running, wait for its answer
+            return await asyncio.shield(future)
+        future = self._inflight[request_key] = self._loop.create_future()
+        try:
+            async with self._semaphore(model):
+                result = await self._retry(lambda: self._call(model, messages, key))
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            # mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._inflight[request_key]
+
+    async def _astream(self, model, messages, key, output):
+        try:
+            async with self._semaphore(model):
+                if model not in OPENAI_MODELS:
+                    output.put(('chunk', await self._retry(
+                        lambda: self._call(model, messages, key))))
+                    return
+                client = self._openai_client(key)
+                # retry only until the first token has arrived
+                response = await self._retry(lambda: client.chat.completions.create(
+                    model=model, messages=messages, stream=True))
+                async for chunk in response:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        output.put(('chunk', chunk.choices[0].delta.content))
+        except Exception as e:
+            output.put(('error', e))
+        finally:
+            output.put(('done', None))
+
+    def complete(self, model, messages, key=None, timeout=TIMEOUT_SECONDS):
+        # blocking entry point for the Streamlit script threads
+        return asyncio.run_coroutine_threadsafe(
+            self.acomplete(resolve_model(model), messages, key), self._loop).result(timeout)
+
+    def stream(self, model, messages, key=None, timeout=TIMEOUT_SECONDS):
+        # yields text chunks as they arrive, backends without streaming yield once
+        output = queue.Queue()
+        asyncio.run_coroutine_threadsafe(
+            self._astream(resolve_model(model), messages, key, output), self._loop)
+        while True:
+            kind, value = output.get(timeout=timeout)
+            if kind == 'chunk':
+                yield value
+            elif kind == 'error':
+                raise value
+            else:
+                return
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = Gateway()
+        return _gateway
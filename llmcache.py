@@ -0,0 +1,69 @@
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+
+# 模型回答的本地缓存，相同的问题不再重复调用API
+CACHE_PATH = '.cache/llm_responses.sqlite3'
+TTL = 7 * 24 * 3600
+MAX_ENTRIES = 5000
+
+
+def make_key(question, model_type):
+    # the formatted question already embeds the description and code primers of the dataset,
+    # whitespace differences are normalized away
+    normalized = re.sub(r'\s+', ' ', question).strip() + '\x00' + model_type
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    # sqlite backed key/value store with a TTL and least-recently-used eviction
+
+    def __init__(self, path=CACHE_PATH, ttl=TTL, max_entries=MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS responses '
+                         '(key TEXT PRIMARY KEY, response TEXT, created REAL, used REAL)')
+        self._db.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT response, created FROM responses WHERE key = ?',
+                                   (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._db.commit()
+                return None
+            self._db.execute('UPDATE responses SET used = ? WHERE key = ?', (now, key))
+            self._db.commit()
+            return row[0]
+
+    def put(self, key, response):
+        now = time.time()
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                             (key, response, now, now))
+            self._db.execute('DELETE FROM responses WHERE created < ?', (now - self.ttl,))
+            self._db.execute('DELETE FROM responses WHERE key IN (SELECT key FROM responses '
+                             'ORDER BY used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+            self._db.commit()
+
+
+_cache = None
+
+
+def get_cache():
+    # created on first use so importing this module does not touch the disk
+    global _cache
+    if _cache is None:
+        _cache = ResponseCache()
+    return _cache
@@ -0,0 +1,42 @@
+import pandas as pd
+
+# 总工作时间为18小时
+TOTAL_WORKING_HOURS = 18
+
+
+def summarize_trips(data):
+    # per-date, per-vehicle order counts and trip hours of a raw OD frame
+    duration = (data['etime'] - data['stime']).dt.total_seconds() / 3600
+    summary = pd.DataFrame({
+        'date': data['stime'].dt.normalize(),
+        'id': data['id'],
+        'hours': duration,
+    })
+    summary = summary.groupby(['date', 'id'], sort=True).agg(
+        orders=('hours', 'size'), hours=('hours', 'sum')).reset_index()
+    return summary
+
+
+def total_orders(summary):
+    return int(summary['orders'].sum())
+
+
+def vehicle_hours(summary):
+    # 计算每辆出租车的行程持续时间
+    return summary.groupby('id')['hours'].sum()
+
+
+def utilization(summary):
+    if summary.empty:
+        return 0.0
+    return float((vehicle_hours(summary) / TOTAL_WORKING_HOURS).mean())
+
+
+def daily_orders(summary):
+    # 按日期计算每天的订单数
+    return summary.groupby('date')['orders'].sum()
+
+
+def top_vehicles(summary):
+    return summary.groupby('id')['orders'].sum().sort_values(
+        ascending=False).reset_index(name='orders')
@@ -0,0 +1,89 @@
+import os
+import numpy as np
+import pandas as pd
+import odstore
+import spatial
+from boundedcache import BoundedCache
+
+# OD流量: 起点和终点按方形网格分区，统计区与区之间每小时的行程数
+ZONE_METERS = 1000
+# weeks start on Sunday like the weekly folders of the data
+PERIODS = {'hour': 'h', 'day': 'D', 'week': 'W-SAT'}
+MAX_DAY_FLOWS = 256
+
+# (partition path, mtime, zone size) -> hourly flows of the day
+_day_flows = BoundedCache(max_entries=MAX_DAY_FLOWS)
+
+
+def zone_keys(lat, lon, size=ZONE_METERS):
+    # the zone of every point is the int64 key of its grid cell, the same on every day
+    row, col, _, _ = spatial.grid_cells(lat, lon, size)
+    return spatial.cell_keys(row, col)
+
+
+def hourly_flows(data, size=ZONE_METERS):
+    # sparse flow table of an OD frame: one row per (hour, origin, destination) with trips
+    frame = pd.DataFrame({
+        'period': data['stime'].dt.floor('h'),
+        'origin': zone_keys(data['slat'], data['slon'], size),
+        'destination': zone_keys(data['elat'], data['elon'], size),
+    })
+    return frame.groupby(['period', 'origin', 'destination'], sort=True).size() \
+        .reset_index(name='trips')
+
+
+def day_flows(week, day, size=ZONE_METERS, store_dir=odstore.STORE_DIR):
+    # hourly flows of one stored day, kept until its partition is rewritten
+    path = odstore.partition_path(week, day, store_dir)
+    columns = ['stime', 'slat', 'slon', 'elat', 'elon']
+    return _day_flows.get_or_compute(
+        (path, os.stat(path).st_mtime_ns, size),
+        lambda: hourly_flows(odstore.read_table(path).select(columns).to_pandas(), size))
+
+
+def range_flows(start, end, period='day', size=ZONE_METERS,
+                od_dir=odstore.OD_DIR, store_dir=odstore.STORE_DIR):
+    # flows of the days in [start, end] per hour, day or week, or over the whole range
+    # for period=None. Only the small per-day flow tables are combined.
+    odstore.ingest_range(start, end, od_dir, store_dir)
+    parts = [day_flows(week, day, size, store_dir)
+             for week, day in odstore.select_days(start, end, od_dir)
+             if os.path.exists(odstore.partition_path(week, day, store_dir))]
+    if not parts:
+        return pd.DataFrame({'period': pd.Series(dtype='datetime64[ns]'),
+                             'origin': pd.Series(dtype='int64'),
+                             'destination': pd.Series(dtype='int64'),
+                             'trips': pd.Series(dtype='int64')})
+    flows = pd.concat(parts, ignore_index=True)
+    if period == 'hour':
+        return flows
+    if period is None:
+        flows = flows.assign(period=pd.Timestamp(start).normalize())
+    elif period == 'week':
+        flows = flows.assign(period=flows['period'].dt.to_period(PERIODS['week']).dt.start_time)
+    else:
+        flows = flows.assign(period=flows['period'].dt.floor(PERIODS[period]))
+    return flows.groupby(['period', 'origin', 'destination'], sort=True)['trips'].sum() \
+        .reset_index()
+
+
+def top_flows(flows, n=200, size=ZONE_METERS, include_internal=False):
+    # the n largest zone pairs over all periods of the table, with zone centers for drawing
+    if not include_internal:
+        flows = flows[flows['origin'] != flows['destination']]
+    pairs = flows.groupby(['origin', 'destination'])['trips'].sum().nlargest(n).reset_index()
+    pairs['slat'], pairs['slon'] = spatial.cell_centers(pairs['origin'], size)
+    pairs['elat'], pairs['elon'] = spatial.cell_centers(pairs['destination'], size)
+    return pairs
+
+
+def flow_matrix(flows):
+    # zone-to-zone scipy sparse matrix summed over the periods, and the zone key of each index
+    from scipy import sparse
+    zones, codes = np.unique(np.concatenate([flows['origin'].to_numpy(),
+                                             flows['destination'].to_numpy()]),
+                             return_inverse=True)
+    origin, destination = codes[:len(flows)], codes[len(flows):]
+    matrix = sparse.coo_matrix((flows['trips'].to_numpy(), (origin, destination)),
+                               shape=(len(zones), len(zones))).tocsr()
+    return matrix, zones
@@ -0,0 +1,270 @@
+import os
+import re
+import json
+import hashlib
+import threading
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import odagg
+import odtypes
+import spatial
+
+# 原始的每日OD文件目录，以及转换后的列式存储目录
+OD_DIR = 'static/1000taxidata/odddata'
+STORE_DIR = 'static/1000taxidata/odstore'
+# daily source files look like oddata_20140803_train.txt
+DAY_PATTERN = re.compile(r'oddata_(\d{8})_train\.txt$')
+MANIFEST_NAME = 'manifest.json'
+# 分区的列类型变化时加一，旧版本的分区会被重新转换
+SCHEMA_VERSION = 4
+
+# ingest is shared by every session of the server process
+_lock = threading.Lock()
+# partition path -> (mtime of the partition file, arrow table)
+_tables = {}
+
+
+def week_list(od_dir=OD_DIR):
+    return sorted(name for name in os.listdir(od_dir)
+                  if os.path.isdir(os.path.join(od_dir, name)))
+
+
+def day_files(week, od_dir=OD_DIR):
+    # (day, source path) pairs of one week, in date order
+    week_dir = os.path.join(od_dir, week)
+    days = []
+    for filename in sorted(os.listdir(week_dir)):
+        match = DAY_PATTERN.search(filename)
+        if match is not None:
+            days.append((match.group(1), os.path.join(week_dir, filename)))
+    return days
+
+
+def partition_path(week, day, store_dir=STORE_DIR):
+    return os.path.join(store_dir, week, day + '.feather')
+
+
+def summary_path(week, day, store_dir=STORE_DIR):
+    # 每日的预聚合结果(每辆车的订单数和行程时间)
+    return os.path.join(store_dir, week, day + '.agg.feather')
+
+
+def index_path(week, day, store_dir=STORE_DIR):
+    # 起点和终点的网格索引，与分区一起保存
+    return os.path.join(store_dir, week, day + '.sidx.feather')
+
+
+def write_feather(data, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write to a temporary file first so readers never see half a partition
+    # uncompressed so the partition can be memory-mapped
+    feather.write_feather(data, path + '.tmp', compression='uncompressed')
+    os.replace(path + '.tmp', path)
+
+
+def file_digest(file_path):
+    sha = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def load_manifest(store_dir=STORE_DIR):
+    # 记录每个源文件的mtime、大小和内容哈希
+    try:
+        with open(os.path.join(store_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest, store_dir=STORE_DIR):
+    path = os.path.join(store_dir, MANIFEST_NAME)
+    os.makedirs(store_dir, exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def read_day_file(file_path):
+    # parse one daily txt file into the compact store schema
+    return odtypes.compact(pd.read_csv(file_path))
+
+
+def remove_partition(week, day, store_dir=STORE_DIR):
+    for path in (partition_path(week, day, store_dir), summary_path(week, day, store_dir),
+                 index_path(week, day, store_dir)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def ingest_week(week, od_dir=OD_DIR, store_dir=STORE_DIR):
+    # convert new or changed day files of the week and return a version string of its content
+    # unchanged files are recognised by mtime and size, touched ones by their content hash.
+    # Files that fail to parse are recorded with their error and skipped until they change.
+    with _lock:
+        manifest = load_manifest(store_dir)
+        changed = False
+        digests = []
+        sources = set()
+        for day, file_path in day_files(week, od_dir):
+            sources.add(file_path)
+            stat = os.stat(file_path)
+            entry = manifest.get(file_path)
+            current = entry is not None and entry.get('schema') == SCHEMA_VERSION
+            failed = current and 'error' in entry
+            stored = current and not failed \
+                and os.path.exists(partition_path(week, day, store_dir)) \
+                and os.path.exists(summary_path(week, day, store_dir)) \
+                and os.path.exists(index_path(week, day, store_dir))
+            if (stored or failed) and entry['mtime'] == stat.st_mtime \
+                    and entry['size'] == stat.st_size:
+                digests.append(entry['sha1'])
+                continue
+            digest = file_digest(file_path)
+            new_entry = {'week': week, 'day': day, 'mtime': stat.st_mtime,
+                         'size': stat.st_size, 'sha1': digest, 'schema': SCHEMA_VERSION}
+            if failed and entry['sha1'] == digest:
+                # touched but still the same broken content
+                new_entry['error'] = entry['error']
+            elif not (stored and entry['sha1'] == digest):
+                try:
+                    data = read_day_file(file_path)
+                except Exception as e:
+                    print(f"Error processing file {file_path}: {e}")
+                    # the partition of an earlier version of the file is out of date
+                    remove_partition(week, day, store_dir)
+                    data = None
+                    new_entry['error'] = str(e)
+                if data is not None:
+                    write_feather(data, partition_path(week, day, store_dir))
+                    write_feather(odagg.summarize_trips(data),
+                                  summary_path(week, day, store_dir))
+                    write_feather(spatial.build_indexes(data), index_path(week, day, store_dir))
+            manifest[file_path] = new_entry
+            digests.append(digest)
+            changed = True
+        # 删除源文件已经不存在的分区
+        for file_path, entry in list(manifest.items()):
+            if entry['week'] == week and file_path not in sources:
+                remove_partition(week, entry['day'], store_dir)
+                del manifest[file_path]
+                changed = True
+        if changed:
+            save_manifest(manifest, store_dir)
+    return hashlib.sha1((str(SCHEMA_VERSION) + ''.join(digests)).encode()).hexdigest()[:12]
+
+
+def ingest(od_dir=OD_DIR, store_dir=STORE_DIR):
+    for week in week_list(od_dir):
+        ingest_week(week, od_dir, store_dir)
+
+
+def read_table(path):
+    # memory-mapped partitions stay in memory until the file is rewritten,
+    # so a week with one new day only reads that day
+    mtime = os.stat(path).st_mtime_ns
+    cached = _tables.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, feather.read_table(path, memory_map=True))
+        _tables[path] = cached
+    return cached[1]
+
+
+def read_partitions(paths):
+    # concatenate the partitions once at the arrow level
+    # partitions whose source failed to parse are skipped
+    tables = [read_table(path) for path in paths if os.path.exists(path)]
+    if not tables:
+        return pd.DataFrame()
+    return pa.concat_tables(tables).to_pandas(split_blocks=True)
+
+
+def load_week(week, od_dir=OD_DIR, store_dir=STORE_DIR):
+    ingest_week(week, od_dir, store_dir)
+    return read_partitions([partition_path(week, day, store_dir)
+                            for day, _ in day_files(week, od_dir)])
+
+
+def load_week_summary(week, od_dir=OD_DIR, store_dir=STORE_DIR):
+    ingest_week(week, od_dir, store_dir)
+    return read_partitions([summary_path(week, day, store_dir)
+                            for day, _ in day_files(week, od_dir)])
+
+
+def load_day(week, day, od_dir=OD_DIR, store_dir=STORE_DIR, ingest=True):
+    # sandbox workers pass ingest=False: only the server process writes the store
+    if ingest:
+        ingest_week(week, od_dir, store_dir)
+    return read_partitions([partition_path(week, day, store_dir)])
+
+
+def day_version(week, day, od_dir=OD_DIR, store_dir=STORE_DIR, ingest=True):
+    # changes whenever the partition of the day is rewritten, None before it exists
+    if ingest:
+        ingest_week(week, od_dir, store_dir)
+    path = partition_path(week, day, store_dir)
+    return os.stat(path).st_mtime_ns if os.path.exists(path) else None
+
+
+def day_index(od_dir=OD_DIR):
+    # (date, week, day) of every daily file of the month, in date order
+    return sorted((pd.Timestamp(day), week, day)
+                  for week in week_list(od_dir) for day, _ in day_files(week, od_dir))
+
+
+def select_days(start, end, od_dir=OD_DIR):
+    # (week, day) of the partitions inside [start, end], the dates come from the file names
+    # so partitions outside the range are never opened
+    start, end = pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize()
+    return [(week, day) for date, week, day in day_index(od_dir) if start <= date <= end]
+
+
+def previous_period(start, end):
+    # the period of the same length right before [start, end]
+    start, end = pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize()
+    length = end - start + pd.Timedelta(days=1)
+    return start - length, start - pd.Timedelta(days=1)
+
+
+def ingest_range(start, end, od_dir=OD_DIR, store_dir=STORE_DIR):
+    # ingest the weeks overlapping the range, the version changes with any of them
+    weeks = dict.fromkeys(week for week, _ in select_days(start, end, od_dir))
+    versions = [ingest_week(week, od_dir, store_dir) for week in weeks]
+    return hashlib.sha1(''.join(versions).encode()).hexdigest()[:12]
+
+
+def load_range(start, end, od_dir=OD_DIR, store_dir=STORE_DIR):
+    ingest_range(start, end, od_dir, store_dir)
+    return read_partitions([partition_path(week, day, store_dir)
+                            for week, day in select_days(start, end, od_dir)])
+
+
+def load_range_summary(start, end, od_dir=OD_DIR, store_dir=STORE_DIR):
+    # the daily summaries of the range, a month is about thirty small tables
+    ingest_range(start, end, od_dir, store_dir)
+    return read_partitions([summary_path(week, day, store_dir)
+                            for week, day in select_days(start, end, od_dir)])
+
+
+def load_range_index(start, end, od_dir=OD_DIR, store_dir=STORE_DIR):
+    # {'start': GridIndex, 'end': GridIndex} over the rows of load_range(start, end),
+    # merged from the stored per-day indexes instead of being rebuilt from the points
+    ingest_range(start, end, od_dir, store_dir)
+    days = [(week, day) for week, day in select_days(start, end, od_dir)
+            if os.path.exists(partition_path(week, day, store_dir))
+            and os.path.exists(index_path(week, day, store_dir))]
+    offsets, indexes, rows = [], [], 0
+    for week, day in days:
+        offsets.append(rows)
+        rows += read_table(partition_path(week, day, store_dir)).num_rows
+        indexes.append(spatial.split_indexes(read_table(index_path(week, day, store_dir))))
+    return {point: spatial.GridIndex.merge([index[point] for index in indexes], offsets)
+            for point in spatial.POINT_COLUMNS}
+
+
+if __name__ == '__main__':
+    # python odstore.py 预先把所有的OD文件转换为列式存储
+    ingest()
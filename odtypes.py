@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import timeparse
+from spatial import METERS_PER_DEGREE
+
+# OD数据的紧凑类型: 整数编号、float32坐标、datetime64时间
+ID_COLUMNS = ('id', 'ID')
+TIME_COLUMNS = ('stime', 'etime')
+COORDINATE_RANGES = {'slon': (-180, 180), 'slat': (-90, 90),
+                     'elon': (-180, 180), 'elat': (-90, 90)}
+# coordinates are only stored as float32 when no point moves by more than this,
+# float32 keeps about 0.8 m around Chengdu's longitude
+MAX_ERROR_METERS = 1.0
+
+
+def is_od_frame(frame):
+    return {'id', *TIME_COLUMNS, *COORDINATE_RANGES} <= set(frame.columns)
+
+
+def compact_ids(column):
+    # int32 for every partition, so the arrow schemas of all days stay the same.
+    # Signed, so differences of ids (id - id.shift()) do not wrap around
+    if not pd.api.types.is_integer_dtype(column.dtype) or column.empty:
+        return column
+    if column.min() < 0 or column.max() >= 2 ** 31:
+        return column
+    return column.astype('int32')
+
+
+def compact_coordinates(column, valid_range):
+    if not pd.api.types.is_float_dtype(column.dtype) or column.empty:
+        return column
+    values = column.to_numpy(dtype='float64')
+    finite = values[np.isfinite(values)]
+    if len(finite) and (finite.min() < valid_range[0] or finite.max() > valid_range[1]):
+        # not degrees, leave the column alone
+        return column
+    compact = values.astype('float32')
+    error = np.abs(finite - compact[np.isfinite(values)].astype('float64'))
+    if len(error) and error.max() * METERS_PER_DEGREE > MAX_ERROR_METERS:
+        return column
+    return pd.Series(compact, index=column.index, name=column.name)
+
+
+def compact(frame):
+    # typed OD frame: about 40 bytes a row instead of 64 with parsed times,
+    # frames of another shape are returned unchanged
+    if not is_od_frame(frame):
+        return frame
+    columns = {}
+    for name in TIME_COLUMNS:
+        try:
+            columns[name] = timeparse.parse(frame[name])
+        except (ValueError, TypeError):
+            pass
+    for name in ID_COLUMNS:
+        if name in frame.columns:
+            columns[name] = compact_ids(frame[name])
+    for name, valid_range in COORDINATE_RANGES.items():
+        columns[name] = compact_coordinates(frame[name], valid_range)
+    return frame.assign(**columns)
@@ -1,27 +1,22 @@
-from openai import OpenAI
+import startup
+startup.page_started('visualize')
 import streamlit as st
 import pandas as pd
-import openai
 
-from classes import get_primer, format_question, run_request
+from classes import get_primer, format_question, stream_request
+from registry import SessionDatasets
+from sandbox import get_sandbox, TRANSIENT_ERRORS
+from figstore import get_store
+startup.start()
+startup.mark('visualize', 'imports')
 st.set_page_config(page_title='可视化模型', page_icon='🧠')
 st.title("🧠可视化模型")
-# List to hold datasets
+# Datasets are shared across sessions through the registry, uploads stay in this session
 if "datasets" not in st.session_state:
-    datasets = {}
-    # Preload datasets
-    datasets["Week1"] = pd.read_csv(
-        "static/1000taxidata/odddata/week1/oddata_20140803_train.txt")
-    datasets["Week2"] = pd.read_csv(
-        "static/1000taxidata/odddata/week2/oddata_20140810_train.txt")
-    datasets["Week3"] = pd.read_csv(
-        "static/1000taxidata/odddata/week3/oddata_20140818_train.txt")
-    datasets["Week4"] = pd.read_csv(
-        "static/1000taxidata/odddata/week4/oddata_20140824_train.txt")
-    st.session_state["datasets"] = datasets
-else:
-    # use the list already loaded
-    datasets = st.session_state["datasets"]
+    st.session_state["datasets"] = SessionDatasets()
+datasets = st.session_state["datasets"]
+# warm up the plotting workers while the user types
+get_sandbox().start()
 # api key
 openai_key = st.secrets['OPENAI_API_KEY']
 hf_key = st.secrets['HF_API_KEY']
@@ -38,6 +33,12 @@ if "messages" not in st.session_state or st.sidebar.button("清空对话记录")
         {"role": "assistant", "content": "What would you like to visualise?"}]
 
 
+@st.cache_data(ttl="2h")
+def load_data(uploaded_file):
+    # parsed once per file instead of on every rerun
+    return pd.read_csv(uploaded_file)
+
+
 # Add facility to upload a dataset
 try:
     uploaded_file = st.file_uploader(
@@ -46,7 +47,7 @@ try:
     if uploaded_file:
         # Read in the data, add it to the list of available datasets. Give it a nice name.
         file_name = uploaded_file.name[:-4].capitalize()
-        datasets[file_name] = pd.read_csv(uploaded_file)
+        datasets.add_upload(file_name, load_data(uploaded_file))
         # We want to default the radio button to the newly added dataset
         index_no = len(datasets)-1
 except Exception as e:
@@ -70,10 +71,25 @@ for message in st.session_state.messages:
     else:
         with st.chat_message('assistant'):
             plot_area = st.empty()
+            # rendered figures are stored with the message, scripts are only
+            # re-run when the figure has been evicted. figure is False when the
+            # script itself failed, those are shown as text without running them again.
+            # Timeouts and a restarting sandbox leave it unset, so the script is retried
+            if message.get('figure') is False:
+                st.markdown(message['content'])
+                continue
+            figure = get_store().get(message.get('figure'))
             try:
-                plot_area.pyplot(exec(message['content']))
+                if figure is None:
+                    figure = get_sandbox().render(
+                        message['content'], datasets.uploads)
+                    message['figure'] = get_store().put(figure)
+                plot_area.image(figure)
+            except TRANSIENT_ERRORS:
+                st.markdown(message['content'])
             except Exception as e:
                 print('Not executable code')
+                message['figure'] = False
                 st.markdown(message['content'])
 #
 if prompt := st.chat_input(''):
@@ -87,21 +103,30 @@ if prompt := st.chat_input(''):
         # Format the question
         question_to_ask = format_question(
             primer_desc, pimer_code, prompt, st.session_state.model)
-        # Run the question
+        # Run the question, showing the code as it streams in
         answer = ""
-        answer = run_request(
-            question_to_ask, st.session_state.model, key=openai_key, alt_key=hf_key)
+        code_area = st.empty()
+        for answer in stream_request(
+                question_to_ask, st.session_state.model, key=openai_key, alt_key=hf_key):
+            code_area.code(pimer_code + answer)
+        code_area.empty()
         # the answer is the completed Python script so add to the beginning of the script to it.
         answer = pimer_code + answer
         plot_area = st.empty()
+        figure_digest = None
         try:
-            plot_area.pyplot(exec(answer))
+            figure = get_sandbox().render(answer, datasets.uploads)
+            figure_digest = get_store().put(figure)
+            plot_area.image(figure)
+        except TRANSIENT_ERRORS as e:
+            st.warning(e)
         except Exception as e:
+            figure_digest = False
             st.warning(e)
             # st.write(answer)
         st.expander('Code', expanded=False).code(answer)
         st.session_state.messages.append(
-            {"role": "assistant", "content": answer})
+            {"role": "assistant", "content": answer, "figure": figure_digest})
 
 
 with st.expander('Data', expanded=False):
@@ -113,3 +138,5 @@ with st.expander('Data', expanded=False):
             dataset_name = list(datasets.keys())[dataset_num]
             st.subheader(dataset_name)
             st.dataframe(datasets[dataset_name], hide_index=True)
+
+startup.mark('visualize', 'first_paint')
@@ -1,10 +1,16 @@
-from langchain.agents import AgentType
-from langchain_experimental.agents import create_pandas_dataframe_agent
-from langchain_community.callbacks import StreamlitCallbackHandler
-from langchain_community.chat_models import ChatOpenAI
+import startup
+startup.page_started('sql')
 import streamlit as st
 import pandas as pd
+from registry import SessionDatasets
+from llm_gateway import get_gateway
+import sqlagent
+import sqlengine
+import chatcontext
+from schema import profile_frame, schema_frame
 import os
+startup.start()
+startup.mark('sql', 'imports')
 st.set_page_config(
     page_title="LangChain: SQL模型", page_icon="🦜"
 )
@@ -19,21 +25,10 @@ file_formats = {
     "xlsb": pd.read_excel,
 }
 
-# List to hold datasets
+# Datasets are shared across sessions through the registry, uploads stay in this session
 if "datasets" not in st.session_state:
-    datasets = {}
-    # Preload datasets
-    datasets["Week1"] = pd.read_csv(
-        "static/1000taxidata/odddata/week1/oddata_20140803_train.txt")
-    datasets["Week2"] = pd.read_csv(
-        "static/1000taxidata/odddata/week2/oddata_20140810_train.txt")
-    datasets["Week3"] = pd.read_csv(
-        "static/1000taxidata/odddata/week3/oddata_20140818_train.txt")
-    datasets["Week4"] = pd.read_csv(
-        "static/1000taxidata/odddata/week4/oddata_20140824_train.txt")
-else:
-    # use the list already loaded
-    datasets = st.session_state["datasets"]
+    st.session_state["datasets"] = SessionDatasets()
+datasets = st.session_state["datasets"]
 
 
 @st.cache_data(ttl="2h")
@@ -57,7 +52,7 @@ try:
     if uploaded_file:
         # Read in the data, add it to the list of available datasets. Give it a nice name.
         file_name = uploaded_file.name[:-4].capitalize()
-        datasets[file_name] = load_data(uploaded_file)
+        datasets.add_upload(file_name, load_data(uploaded_file))
         # We want to default the radio button to the newly added dataset
         index_no = len(datasets)-1
 except Exception as e:
@@ -76,46 +71,81 @@ with st.sidebar:
         ['gpt-4', 'gpt-3.5-turbo', 'gpt-4o'],
     )
     st.session_state["model"] = chosen_model
+    # SQL: the model writes SQL that DuckDB runs over the stored week tables and uploads,
+    # Pandas agent: the model writes pandas code against the chosen dataset
+    chosen_mode = st.radio(':gear: Mode:', ['SQL', 'Pandas agent'])
 
 
 if "messages" not in st.session_state or st.sidebar.button("Clear history"):
     st.session_state["messages"] = [
         {"role": "assistant", "content": "How can I help you?"}]
+    # what is sent to the model: recent turns within a token budget and a summary of the rest
+    st.session_state["context"] = chatcontext.ConversationContext()
+    # a new conversation starts without cached tool results
+    sqlagent.reset_agent(st.session_state)
 
 # dispaly chat history
 for msg in st.session_state.messages:
-    st.chat_message(msg["role"]).write(msg["content"])
+    with st.chat_message(msg["role"]):
+        st.write(msg["content"])
+        if msg.get("frame") is not None:
+            st.dataframe(msg["frame"], hide_index=True)
 
 if prompt := st.chat_input():
     st.session_state.messages.append({"role": "user", "content": prompt})
     st.chat_message("user").write(prompt)
+    context = st.session_state.setdefault("context", chatcontext.ConversationContext())
+    summarize = chatcontext.llm_summarizer(chosen_model, openai_api_key)
 
     if not openai_api_key:
         st.info("please input your openai api token.")
         st.stop()
 
-    llm = ChatOpenAI(
-        temperature=0, model=chosen_model, openai_api_key=openai_api_key, streaming=True
-    )
-
-    pandas_df_agent = create_pandas_dataframe_agent(
-        llm,
-        datasets[chosen_dataset],
-        verbose=True,
-        agent_type=AgentType.OPENAI_FUNCTIONS,
-        handle_parsing_errors=True,
-    )
-
-    with st.chat_message("assistant"):
-        st_cb = StreamlitCallbackHandler(
-            st.container(), expand_new_thoughts=False)
-        response = pandas_df_agent.run(
-            st.session_state.messages, callbacks=[st_cb])
-        response = pandas_df_agent.run(
-            st.session_state.messages)
-        st.session_state.messages.append(
-            {"role": "assistant", "content": response})
-        st.write(response)
+    if chosen_mode == 'SQL':
+        # the cursor of this session, the store tables are shared by every session
+        if "sql" not in st.session_state:
+            st.session_state["sql"] = sqlengine.SqlSession()
+        sql_session = st.session_state["sql"]
+        with st.chat_message("assistant"):
+            try:
+                tables = sql_session.sync(datasets.uploads)
+                sql = sqlengine.generate_sql(prompt, sql_session.describe(tables),
+                                             chosen_model, openai_api_key,
+                                             context.messages(summarize))
+                st.code(sql, language='sql')
+                result = sql_session.query(sql)
+                st.dataframe(result, hide_index=True)
+                st.session_state.messages.append(
+                    {"role": "assistant", "content": f"```sql\n{sql}\n```", "frame": result})
+                context.add("user", prompt)
+                context.add("assistant", f"```sql\n{sql}\n```\nreturned {len(result)} rows")
+            except Exception as e:
+                st.error(f"Query failed: {e}")
+    else:
+        # langchain is only imported once the agent mode is used
+        from langchain_community.callbacks import StreamlitCallbackHandler
+        # the chat model and its connection pool are shared through the gateway
+        llm = get_gateway().chat_model(
+            chosen_model, openai_api_key, temperature=0, streaming=True)
+
+        # the agent is kept for the whole conversation and rebuilt only when the dataset,
+        # model or key changes
+        pandas_df_agent = sqlagent.get_agent(
+            st.session_state, llm, chosen_dataset, datasets[chosen_dataset],
+            chosen_model, openai_api_key)
+
+        with st.chat_message("assistant"):
+            st_cb = StreamlitCallbackHandler(
+                st.container(), expand_new_thoughts=False)
+            # run once, the callback streams the intermediate steps
+            # the agent sees the bounded context, not the whole history
+            context.add("user", prompt)
+            response = pandas_df_agent.run(
+                context.messages(summarize), callbacks=[st_cb])
+            st.session_state.messages.append(
+                {"role": "assistant", "content": response})
+            context.add("assistant", response)
+            st.write(response)
 
 with st.expander('Data', expanded=False):
     tab_list = st.tabs(datasets.keys())
@@ -125,4 +155,9 @@ with st.expander('Data', expanded=False):
             # Can't get the name of the tab! Can't index key list. So convert to list and index
             dataset_name = list(datasets.keys())[dataset_num]
             st.subheader(dataset_name)
+            # column profile shared with the visualisation model's primer
+            st.dataframe(schema_frame(profile_frame(datasets[dataset_name])),
+                         hide_index=True)
             st.dataframe(datasets[dataset_name], hide_index=True)
+
+startup.mark('sql', 'first_paint')
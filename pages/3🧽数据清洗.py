@@ -1,17 +1,28 @@
+import startup
+startup.page_started('cleaning')
 import streamlit as st
-from time import sleep
-from stqdm import stqdm
 from datetime import datetime
 import pandas as pd
-import transbigdata as tbd
+import cleaning
+import export
 
+startup.start()
+startup.mark('cleaning', 'imports')
 st.title('🧽数据清洗中心')
 
+# 可下载的结果: 结果名称 -> (按钮文字, 文件名前缀)
+DOWNLOADS = {
+    'clear_data': ('下载清洗后的数据', 'clear_data'),
+    'oddata': ('下载OD数据', 'oddata'),
+    'data_idle': ('下载闲置轨迹数据', 'data_idel'),
+    'data_deliver': ('下载配送轨迹数据', 'datad_liver'),
+}
 
-@st.cache_data  # 保存函数
-def convert_df(df):
-    # IMPORTANT: Cache the conversion to prevent computation on every rerun
-    return df.to_csv().encode('utf-8')
+
+@st.cache_data(max_entries=2)
+def read_upload(uploaded_file, encoding, nrows=None):
+    # 上传的文件只解析一次，之后的每次运行都从缓存中读取
+    return pd.read_csv(uploaded_file, encoding=encoding, nrows=nrows)
 
 
 # 文件上传
@@ -23,6 +34,7 @@ clear_opt = st.multiselect(
     ['删除瞬时变化', '删除漂移', '稀疏化', '轨迹致密化', '删除相同的数据'],
     help='删除瞬时变化:\n从出租车数据中删除乘客携带状态的瞬时变化记录。这些异常记录会影响旅行订单判断。判断方法：如果同一车辆上一条记录和下一条记录的乘客状态与该记录不同,则应删除该记录。删除轨迹数据中的漂移:漂移定义为速度大于速度限制或当前点与下一个点之间的距离大于距离限制或当前点与前一点和下一个点之间的角度小于角度限制的数据。限速默认为80km/h，距离限制默认为1000m'
 )
+time_gap = None
 if '稀疏化' in clear_opt:
     time_gap = st.number_input('输入时间间隔,以秒为单位', step=60, value=60*60)
 op_opt = st.multiselect(
@@ -31,9 +43,22 @@ encoding_opt = st.selectbox(
     '编码格式',
     ['utf', 'gbk']
 )
+# 大文件分块读取，按车辆分组后逐块清洗，内存占用取决于块大小而不是文件大小
+stream_opt = st.checkbox('分块流式处理(适用于大文件)')
+if stream_opt:
+    chunksize = st.number_input('每块行数', step=100000, value=500000, min_value=1000)
+# 每个清洗步骤都是按车辆独立计算的，可以按车辆拆分后多进程并行
+workers = st.slider('并行进程数', 1, max(cleaning.WORKERS, 2), cleaning.WORKERS,
+                    disabled=stream_opt)
+OpenStatus_sel = None
 if uploaded_file is not None:
-    # To read file as bytes:
-    dataframe = pd.read_csv(uploaded_file, encoding=encoding_opt)
+    if stream_opt:
+        # 只读取前几行用于选择列和预览
+        dataframe = read_upload(uploaded_file, encoding_opt, 1000)
+        uploaded_file.seek(0)
+    else:
+        # To read file as bytes:
+        dataframe = read_upload(uploaded_file, encoding_opt)
     # 显示读取的信息
     st.write(dataframe)
     if dataframe is not None:
@@ -87,101 +112,57 @@ if uploaded_file is not None:
 
 placeholder = st.empty()
 if st.button('点击开始'):
-    placeholder.txt('转换时间格式中')
-    try:
-        dataframe[time_sel] = pd.to_datetime(dataframe[time_sel])
-    except TypeError:
-        placeholder.warning(TypeError)
-    placeholder.txt('finish🍪')
-    if '稀疏化' in clear_opt:
-        placeholder.txt('开始轨迹稀疏化...')
-        if (time_gap is None) & (int(time_gap) == 0):
-            time_gap = 60*60
-        try:
-            dataframe = tbd.traj_sparsify(
-                dataframe, col=[id_sel, time_sel, lon_sel, lat_sel], timegap=time_gap, method='subsample')
-        except Exception:
-            placeholder.warning(Exception)
-        placeholder.txt('完成')
-
-    if '删除漂移' in clear_opt:
-        # 删除轨迹数据中的漂移。
-        placeholder.txt('删除轨迹数据中的漂移')
-        try:
-            dataframe = tbd.traj_clean_drift(dataframe, col=[
-                id_sel, time_sel, lon_sel, lat_sel], method='twoside', speedlimit=80, dislimit=1000)
-        except:
-            placeholder.warning(Exception)
-
-    if '删除相同的数据' in clear_opt:
-        placeholder.txt("删除与前后数据信息相同的数据")
-        try:
-            dataframe = tbd.traj_clean_redundant(
-                dataframe, col=[id_sel, time_sel, lon_sel, lat_sel])
-        except Exception:
-            placeholder.warning(Exception)
-
-    if '删除相同的数据' in clear_opt:
-        placeholder.txt('从出租车数据中删除乘客携带状态的瞬时变化记录')
-        try:
-            dataframe = tbd.clean_taxi_status(
-                dataframe, col=[id_sel, time_sel, OpenStatus_sel], timelimit=None)
-        except Exception:
-            placeholder.warning(Exception)
-
-    if '提取OD' in op_opt:
-
-        placeholder.write('提取OD信息')
-        try:
-            oddata = tbd.taxigps_to_od(
-                dataframe, col=[id_sel, time_sel, lon_sel, lat_sel, OpenStatus_sel])
-        except Exception:
-            placeholder.warning(Exception)
-
-    if '提取配送和闲置轨迹' in op_opt:
-        placeholder.txt("提取配送和闲置行程的轨迹点")
-        try:
-            data_deliver, data_idle = tbd.taxigps_traj_point(
-                dataframe, oddata, col=[id_sel, time_sel, lon_sel, lat_sel, OpenStatus_sel])
-        except Exception:
-            placeholder.warning(Exception)
-# 假的进度条
-    for _ in stqdm(range(50)):
-        sleep(0.05)
-# 获取当前时间
+    cols = {'id': id_sel, 'time': time_sel, 'lon': lon_sel,
+            'lat': lat_sel, 'status': OpenStatus_sel}
+    # 真实的进度条，由每个阶段(或每个分块)完成时驱动
+    progress_bar = st.progress(0.0)
+    log = cleaning.RunLog(
+        planned=len(cleaning.planned_stages(clear_opt, op_opt)),
+        progress=lambda fraction, stage: progress_bar.progress(fraction, text=stage))
+    # 运行出错时也要停止内存跟踪
+    with log:
+        if stream_opt:
+            # 结果逐块写入csv文件，这里只保存文件路径
+            results = cleaning.stream_clean(
+                uploaded_file, cols, clear_opt, op_opt, time_gap, encoding=encoding_opt,
+                chunksize=int(chunksize), total_bytes=uploaded_file.size,
+                notify=placeholder.text, warn=placeholder.warning, log=log)
+        else:
+            results = cleaning.parallel_steps(
+                dataframe, cols, clear_opt, op_opt, time_gap, workers=workers,
+                notify=placeholder.text, warn=placeholder.warning, log=log)
+    log.write({'file': uploaded_file.name, 'clear_opt': clear_opt, 'op_opt': op_opt,
+               'stream': stream_opt, 'workers': workers})
+    progress_bar.empty()
     placeholder.empty()
-    current_time = datetime.now()
-# download data
-    col_1, col_2, col_3, col_4 = st.columns(4)
-    with col_1:
-        st.download_button(
-            label="下载清洗后的数据",
-            data=convert_df(dataframe),
-            file_name=f'clear_data-{current_time}.csv',
-            mime='txt/csv',
-            key='download_clear'
-        )
-    with col_2:
-        st.download_button(
-            label="下载OD数据CSV",
-            data=convert_df(oddata),
-            file_name=f'oddata-{current_time}.csv',
-            mime='txt/csv',
-            key='download_od'
-        )
-    with col_3:
-        st.download_button(
-            label="下载闲置轨迹数据",
-            data=convert_df(data_idle),
-            file_name=f'data_idel-{current_time}.csv',
-            mime='txt/csv',
-            key='download_idle'
-        )
-    with col_4:
-        st.download_button(
-            label="下载配送轨迹数据",
-            data=convert_df(data_deliver),
-            file_name=f'datad_liver_{current_time}.csv',
-            mime='txt/csv',
-            key='download_deliver'
-        )
+    # 保存结果，点击下载时页面会重新运行; 上一次流式运行的文件随之删除
+    cleaning.remove_outputs(st.session_state.get('cleaning_results', {}))
+    st.session_state['cleaning_results'] = results
+    st.session_state['cleaning_stages'] = log.stages
+    st.session_state['cleaning_time'] = datetime.now()
+
+if 'cleaning_results' in st.session_state:
+    results = st.session_state['cleaning_results']
+    # 各阶段的行数、耗时和峰值内存
+    with st.expander('运行记录', expanded=False):
+        st.dataframe(st.session_state['cleaning_stages'],
+                     hide_index=True, use_container_width=True)
+    current_time = st.session_state['cleaning_time']
+    # 只有点击后才序列化对应的结果，相同内容的结果会复用缓存
+    export_format = st.selectbox('下载格式', list(export.FORMATS))
+    extension, mime = export.FORMATS[export_format]
+    download_cols = st.columns(4)
+    for download_col, (name, (label, prefix)) in zip(download_cols, DOWNLOADS.items()):
+        if name not in results:
+            continue
+        with download_col:
+            if st.button(label, key='prepare_' + name):
+                st.download_button(
+                    label='保存' + extension,
+                    data=export.prepare(results[name], export_format),
+                    file_name=f'{prefix}-{current_time}{extension}',
+                    mime=mime,
+                    key='download_' + name
+                )
+
+startup.mark('cleaning', 'first_paint')
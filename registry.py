@@ -0,0 +1,134 @@
+import threading
+import weakref
+from collections import OrderedDict
+from collections.abc import Mapping
+import odstore
+import odtypes
+
+# 模型页面预加载的数据集: 名称 -> (周, 日)
+PRELOADED = {
+    "Week1": ("week1", "20140803"),
+    "Week2": ("week2", "20140810"),
+    "Week3": ("week3", "20140818"),
+    "Week4": ("week4", "20140824"),
+}
+# 进程内共享数据集的内存上限，以及每个会话最多保留的上传文件数
+MAX_BYTES = 1024 ** 3
+MAX_UPLOADS = 3
+
+
+def frame_bytes(frame):
+    return int(frame.memory_usage(index=True, deep=True).sum())
+
+
+class DatasetRegistry:
+    # Process-wide, read-only datasets shared by every session and page.
+    # Frames are loaded on first use and reference counted by the sessions holding them;
+    # unreferenced frames are evicted least recently used first once over max_bytes.
+    # versions[name]() identifies the stored data, a frame is loaded again when it changes.
+
+    def __init__(self, loaders, max_bytes=MAX_BYTES, versions=None):
+        self._loaders = loaders
+        self._max_bytes = max_bytes
+        self._versions = versions or {}
+        self._frames = OrderedDict()
+        self._frame_versions = {}
+        self._sizes = {}
+        self._refs = {}
+        self._lock = threading.Lock()
+
+    def names(self):
+        return list(self._loaders)
+
+    def acquire(self, name):
+        with self._lock:
+            frame = self._frames.get(name)
+            version = self._versions[name]() if name in self._versions else None
+            if frame is None or self._frame_versions.get(name) != version:
+                # sessions holding the old frame keep it until they access the name again
+                frame = self._loaders[name]()
+                self._frames[name] = frame
+                self._frame_versions[name] = version
+                self._sizes[name] = frame_bytes(frame)
+            self._frames.move_to_end(name)
+            self._refs[name] = self._refs.get(name, 0) + 1
+            self._evict()
+            return frame
+
+    def release(self, name):
+        with self._lock:
+            self._refs[name] = max(self._refs.get(name, 0) - 1, 0)
+            self._evict()
+
+    def _evict(self):
+        total = sum(self._sizes.values())
+        for name in list(self._frames):
+            if total <= self._max_bytes:
+                break
+            if self._refs.get(name, 0) == 0:
+                total -= self._sizes.pop(name)
+                del self._frames[name]
+                self._frame_versions.pop(name, None)
+
+
+def release_all(registry, held):
+    for name in held:
+        registry.release(name)
+    held.clear()
+
+
+class SessionDatasets(Mapping):
+    # The datasets one browser session sees: the shared registry plus a bounded overlay of
+    # its own uploads. Shared frames are acquired on first access and released when the
+    # session state holding this object is dropped.
+
+    def __init__(self, registry=None, max_uploads=MAX_UPLOADS):
+        self._registry = registry or default_registry
+        self._max_uploads = max_uploads
+        self._held = set()
+        self.uploads = OrderedDict()
+        weakref.finalize(self, release_all, self._registry, self._held)
+
+    def add_upload(self, name, frame):
+        # uploads shaped like the OD data get the same compact types as the store
+        if frame is not None:
+            frame = odtypes.compact(frame)
+        self.uploads.pop(name, None)
+        self.uploads[name] = frame
+        while len(self.uploads) > self._max_uploads:
+            self.uploads.popitem(last=False)
+
+    def __getitem__(self, name):
+        if name in self.uploads:
+            return self.uploads[name]
+        if name not in self._registry.names():
+            raise KeyError(name)
+        frame = self._registry.acquire(name)
+        if name in self._held:
+            # the session already holds a reference
+            self._registry.release(name)
+        self._held.add(name)
+        return frame
+
+    def __iter__(self):
+        for name in self._registry.names():
+            if name not in self.uploads:
+                yield name
+        yield from self.uploads
+
+    def __len__(self):
+        return len(set(self._registry.names()) | set(self.uploads))
+
+
+def store_registry(ingest=True):
+    # the preloaded days, sandbox workers read them without converting changed day files
+    # the first version check converts changed day files, the load after it only reads
+    return DatasetRegistry(
+        {name: (lambda week=week, day=day: odstore.load_day(week, day, ingest=False))
+         for name, (week, day) in PRELOADED.items()},
+        versions={name: (lambda week=week, day=day: odstore.day_version(week, day,
+                                                                        ingest=ingest))
+                  for name, (week, day) in PRELOADED.items()})
+
+
+default_registry = store_registry()
@@ -0,0 +1,184 @@
+import io
+import os
+import hashlib
+import figstore
+import resource
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+# 在独立的进程池中执行模型生成的绘图代码
+WORKERS = 2
+CPU_SECONDS = 20
+WALL_SECONDS = 30
+MEMORY_BYTES = 4 * 1024 ** 3
+MAX_INDEX = 4096
+
+
+class SandboxBusy(RuntimeError):
+    # the pool could not run the script right now, nothing wrong with the script itself
+    pass
+
+
+# failures worth running the script again later, a wall timeout can come from load too
+TRANSIENT_ERRORS = (TimeoutError, SandboxBusy)
+
+
+def init_worker(memory_bytes):
+    # pre-warm the worker: import the plotting stack once, then cap its address space
+    os.environ.setdefault('OPENBLAS_NUM_THREADS', '1')
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot
+    import pandas
+    import registry
+    import spatial
+    # the server process owns the store, workers only read its partitions
+    registry.default_registry = registry.store_registry(ingest=False)
+    resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+
+
+def refers_to(code, name):
+    return '"' + name + '"' in code or "'" + name + "'" in code
+
+
+def ping():
+    return os.getpid()
+
+
+def render_in_worker(code, uploads, cpu_seconds):
+    import matplotlib.pyplot as plt
+    from registry import SessionDatasets
+    from spatial import frame_index
+    # the CPU limit counts the worker's whole lifetime, so move it past what is already used
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    used = int(usage.ru_utime + usage.ru_stime) + 1
+    hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+    soft = used + cpu_seconds
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+    plt.close('all')
+    datasets = SessionDatasets()
+    for name, frame in uploads.items():
+        datasets.add_upload(name, frame)
+    exec(code, {'datasets': datasets, 'od_index': frame_index})
+    fig = plt.gcf()
+    if not fig.get_axes():
+        plt.close('all')
+        raise ValueError('The script did not draw a figure')
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', bbox_inches='tight')
+    plt.close('all')
+    return buffer.getvalue()
+
+
+class Sandbox:
+    # Pool of pre-warmed worker processes that execute generated scripts under CPU, memory
+    # and wall time limits and return the figure as PNG bytes. The code hash maps to the
+    # figure's digest in the figure store, which owns the bytes and their eviction.
+
+    def __init__(self, workers=WORKERS, cpu_seconds=CPU_SECONDS, wall_seconds=WALL_SECONDS,
+                 memory_bytes=MEMORY_BYTES):
+        self.workers = workers
+        self.cpu_seconds = cpu_seconds
+        self.wall_seconds = wall_seconds
+        self.memory_bytes = memory_bytes
+        self._pool = None
+        self._lock = threading.Lock()
+        self._figures = {}
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=init_worker,
+                    initargs=(self.memory_bytes,))
+                # start every worker now instead of on the first question
+                for _ in range(self.workers):
+                    self._pool.submit(ping)
+            return self._pool
+
+    def _restart(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        # a script stuck past its wall time cannot be cancelled, only killed
+        # the pool may already be shut down by another session's render
+        for process in list((getattr(pool, '_processes', None) or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def start(self):
+        self._get_pool()
+
+    def figure_key(self, code, uploads):
+        # the code, the full content of the uploads it uses and the stored version of
+        # the preloaded days it refers to, so edited uploads and re-ingested days draw again
+        import odstore
+        from registry import PRELOADED
+        from schema import content_hash
+        sha = hashlib.sha256(code.encode('utf-8'))
+        for name in sorted(uploads):
+            sha.update(name.encode('utf-8') + content_hash(uploads[name]).encode())
+        for name, (week, day) in sorted(PRELOADED.items()):
+            if refers_to(code, name) and name not in uploads:
+                sha.update(f'{name}:{odstore.day_version(week, day)}'.encode('utf-8'))
+        return sha.hexdigest()
+
+    def render(self, code, uploads=None):
+        # plain text answers fail here without a round trip to a worker
+        compile(code, '<generated>', 'exec')
+        # only the uploads the script refers to are sent to the worker,
+        # preloaded datasets are read from the OD store inside the worker
+        uploads = {name: frame for name, frame in (uploads or {}).items()
+                   if refers_to(code, name)}
+        key = self.figure_key(code, uploads)
+        store = figstore.get_store()
+        png = store.get(self._figures.get(key))
+        if png is not None:
+            return png
+        for attempt in range(2):
+            pool = self._get_pool()
+            try:
+                future = pool.submit(render_in_worker, code, uploads, self.cpu_seconds)
+            except RuntimeError:
+                # the pool was shut down by another render since we got it
+                continue
+            try:
+                png = future.result(timeout=self.wall_seconds)
+                break
+            except TimeoutError:
+                self._restart(pool)
+                raise TimeoutError(f'The script did not finish within {self.wall_seconds} seconds')
+            except BrokenProcessPool:
+                # A killed worker breaks the pool for every script running in it, including
+                # scripts of other sessions when one of them timed out or hit a limit.
+                # Run once more on a fresh pool, a script over its limit fails again.
+                self._restart(pool)
+                if attempt:
+                    raise RuntimeError('The script exceeded its CPU or memory limit')
+        else:
+            raise SandboxBusy('The sandbox was restarting, please try again')
+        with self._lock:
+            self._figures[key] = store.put(png)
+            # the digests are tiny, just keep the index from growing forever
+            while len(self._figures) > MAX_INDEX:
+                del self._figures[next(iter(self._figures))]
+        return png
+
+
+_sandbox = None
+_sandbox_lock = threading.Lock()
+
+
+def get_sandbox():
+    # one pool per server process, shared by every session
+    global _sandbox
+    with _sandbox_lock:
+        if _sandbox is None:
+            _sandbox = Sandbox()
+        return _sandbox
@@ -0,0 +1,99 @@
+import hashlib
+import numpy as np
+import pandas as pd
+from boundedcache import BoundedCache
+
+# object/string columns with fewer unique values than this are listed as categorical
+CATEGORY_LIMIT = 20
+# rows looked at before deciding a column has too many values to be categorical
+SKETCH_ROWS = 10000
+# rows hashed into the dataset fingerprint
+FINGERPRINT_ROWS = 64
+MAX_PROFILES = 64
+
+_profiles = BoundedCache(max_entries=MAX_PROFILES)
+
+
+def fingerprint(df):
+    # shape, columns, dtypes and an evenly spaced row sample identify a dataset
+    # without hashing every row
+    sha = hashlib.sha1(repr((df.shape, [str(x) for x in df.columns],
+                             [str(x) for x in df.dtypes])).encode())
+    if len(df):
+        rows = np.unique(np.linspace(0, len(df) - 1, FINGERPRINT_ROWS).astype('int64'))
+        sample = df.iloc[rows]
+        try:
+            sha.update(pd.util.hash_pandas_object(sample, index=False).values.tobytes())
+        except TypeError:
+            # unhashable cell values such as lists
+            sha.update(sample.to_csv().encode())
+    return sha.hexdigest()
+
+
+def content_hash(df):
+    # every row and column, for keys that must change whenever any value does
+    sha = hashlib.sha1(repr(([str(x) for x in df.columns], [str(x) for x in df.dtypes])).encode())
+    try:
+        sha.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    except TypeError:
+        # unhashable cell values such as lists
+        sha.update(df.to_csv().encode())
+    return sha.hexdigest()
+
+
+def is_text(column):
+    return pd.api.types.is_object_dtype(column.dtype) or pd.api.types.is_string_dtype(column.dtype)
+
+
+def categorical_values(column):
+    # a prefix with too many distinct values already rules the column out,
+    # only low cardinality columns pay for a full pass
+    if column.iloc[:SKETCH_ROWS].nunique(dropna=False) >= CATEGORY_LIMIT:
+        return None
+    values = pd.unique(column)
+    if len(values) >= CATEGORY_LIMIT:
+        return None
+    return [str(x) for x in values]
+
+
+def profile_column(name, column):
+    profile = {'name': str(name), 'dtype': str(column.dtype), 'kind': 'other', 'values': None}
+    if pd.api.types.is_numeric_dtype(column.dtype) and not pd.api.types.is_bool_dtype(column.dtype):
+        profile['kind'] = 'numeric'
+    elif pd.api.types.is_datetime64_any_dtype(column.dtype):
+        profile['kind'] = 'datetime'
+    elif is_text(column):
+        profile['values'] = categorical_values(column)
+        if profile['values'] is not None:
+            profile['kind'] = 'categorical'
+    return profile
+
+
+def profile_frame(df):
+    # column dtypes and categorical value sets, cached per dataset fingerprint
+    return _profiles.get_or_compute(
+        fingerprint(df), lambda: [profile_column(name, df[name]) for name in df.columns])
+
+
+def describe_columns(profile):
+    # primer sentences for the columns, shared by the prompt builders
+    parts = ["Use a dataframe called df from data_file.csv with columns '"
+             + "','".join(column['name'] for column in profile) + "'. "]
+    for column in profile:
+        if column['kind'] == 'categorical':
+            parts.append("\nThe column '" + column['name'] + "' has categorical values '"
+                         + "','".join(column['values']) + "'. ")
+        elif column['kind'] == 'numeric':
+            parts.append("\nThe column '" + column['name'] + "' is type "
+                         + column['dtype'] + " and contains numeric values. ")
+    return "".join(parts)
+
+
+def schema_frame(profile):
+    # one row per column, for showing the profile in the pages
+    return pd.DataFrame({
+        'column': [column['name'] for column in profile],
+        'dtype': [column['dtype'] for column in profile],
+        'kind': [column['kind'] for column in profile],
+        'values': [", ".join(column['values']) if column['values'] else "" for column in profile],
+    })
@@ -0,0 +1,207 @@
+import numpy as np
+import pandas as pd
+from schema import content_hash
+from boundedcache import BoundedCache
+
+# 每度纬度对应的米数
+METERS_PER_DEGREE = 111320
+# 网格的参考纬度(成都)，经度方向的格子按这个纬度缩放成近似正方形
+REF_LAT = 30.659462
+
+
+def cell_size(zoom, pixels=8):
+    # width in meters of a grid cell that covers roughly `pixels` screen pixels at a pydeck zoom level
+    # deck.gl uses 512px tiles, so one pixel is half of the usual web mercator resolution
+    return 78271.52 * np.cos(np.radians(REF_LAT)) / 2 ** zoom * pixels
+
+
+def grid_cells(lat, lon, size):
+    # integer (row, col) of the square grid cell of every point
+    lat_step = size / METERS_PER_DEGREE
+    lon_step = lat_step / np.cos(np.radians(REF_LAT))
+    row = np.floor(np.asarray(lat, dtype='float64') / lat_step).astype('int64')
+    col = np.floor(np.asarray(lon, dtype='float64') / lon_step).astype('int64')
+    return row, col, lat_step, lon_step
+
+
+def bin_points(lat, lon, size):
+    # count points per grid cell, returning the south-west corner of every non-empty cell
+    row, col, lat_step, lon_step = grid_cells(lat, lon, size)
+    counts = pd.DataFrame({'row': row, 'col': col}).value_counts().reset_index(name='count')
+    counts['lat'] = counts['row'] * lat_step
+    counts['lon'] = counts['col'] * lon_step
+    # 0~1的权重用来给格子上色
+    counts['weight'] = counts['count'] / counts['count'].max() if len(counts) else 0.0
+    return counts[['lat', 'lon', 'count', 'weight']]
+
+
+# 空间索引的格子边长(米)，半径和范围查询只检查与查询范围相交的格子
+INDEX_CELL_METERS = 250
+# 起点和终点的坐标列
+POINT_COLUMNS = {'start': ('slat', 'slon'), 'end': ('elat', 'elon')}
+MAX_FRAME_INDEXES = 16
+# 告诉模型可以使用的空间索引函数
+HELPER_PROMPT = ("A function od_index(df, 'start' or 'end') returns a spatial index of the start "
+                 "or end points with radius(lat, lon, meters) and bbox(south, west, north, east) "
+                 "returning row positions for df.iloc, count_radius(lat, lon, meters), and "
+                 "hotspots(k, size_meters) returning the k busiest cells as lat, lon, count. "
+                 "Use it instead of computing distances to every row. ")
+# keeps negative rows and columns positive inside the int64 cell keys
+KEY_OFFSET = 2 ** 30
+
+_frame_indexes = BoundedCache(max_entries=MAX_FRAME_INDEXES)
+
+
+def cell_keys(row, col):
+    # one sortable int64 per cell, the cells of one grid row are contiguous
+    return (row + KEY_OFFSET) * 2 ** 32 + (col + KEY_OFFSET)
+
+
+def key_cells(keys):
+    return keys // 2 ** 32 - KEY_OFFSET, keys % 2 ** 32 - KEY_OFFSET
+
+
+def distance_meters(lat1, lon1, lat2, lon2):
+    # equirectangular approximation, accurate to well under a meter at city scale
+    x = np.radians(lon2 - lon1) * np.cos(np.radians((lat1 + lat2) / 2))
+    y = np.radians(lat2 - lat1)
+    return np.sqrt(x * x + y * y) * 6371000
+
+
+class GridIndex:
+    # Points sorted by the square grid cell they fall in. A query looks up the key range of
+    # every grid row it touches with a binary search, then checks only those points exactly.
+    # rows holds the position of every point in the frame the index was built from.
+
+    def __init__(self, keys, lat, lon, rows, size=INDEX_CELL_METERS):
+        self.keys = keys
+        self.lat = lat
+        self.lon = lon
+        self.rows = rows
+        self.size = size
+        _, _, self.lat_step, self.lon_step = grid_cells([], [], size)
+
+    @classmethod
+    def build(cls, lat, lon, size=INDEX_CELL_METERS):
+        lat = np.asarray(lat, dtype='float64')
+        lon = np.asarray(lon, dtype='float64')
+        valid = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+        row, col, _, _ = grid_cells(lat[valid], lon[valid], size)
+        keys = cell_keys(row, col)
+        order = np.argsort(keys, kind='stable')
+        return cls(keys[order], lat[valid][order], lon[valid][order],
+                   valid[order].astype('int64'), size)
+
+    @classmethod
+    def merge(cls, indexes, offsets):
+        # one index over frames concatenated in order, offsets are their first row positions
+        if not indexes:
+            return cls.build([], [])
+        keys = np.concatenate([index.keys for index in indexes])
+        order = np.argsort(keys, kind='stable')
+        return cls(keys[order],
+                   np.concatenate([index.lat for index in indexes])[order],
+                   np.concatenate([index.lon for index in indexes])[order],
+                   np.concatenate([index.rows + offset
+                                   for index, offset in zip(indexes, offsets)])[order],
+                   indexes[0].size)
+
+    def to_frame(self):
+        return pd.DataFrame({'key': self.keys, 'lat': self.lat, 'lon': self.lon, 'row': self.rows})
+
+    @classmethod
+    def from_frame(cls, frame, size=INDEX_CELL_METERS):
+        return cls.from_columns(frame, 0, len(frame), size)
+
+    @classmethod
+    def from_columns(cls, columns, start, stop, size=INDEX_CELL_METERS):
+        # rows start:stop of a frame or arrow table written by to_frame
+        return cls(np.asarray(columns['key'])[start:stop],
+                   np.asarray(columns['lat'], dtype='float64')[start:stop],
+                   np.asarray(columns['lon'], dtype='float64')[start:stop],
+                   np.asarray(columns['row'])[start:stop], size)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _candidates(self, south, west, north, east):
+        # positions in the index of the points in the cells overlapping the box
+        row0, col0 = int(np.floor(south / self.lat_step)), int(np.floor(west / self.lon_step))
+        row1, col1 = int(np.floor(north / self.lat_step)), int(np.floor(east / self.lon_step))
+        rows = np.arange(row0, row1 + 1)
+        if not len(rows):
+            return np.empty(0, dtype='int64')
+        starts = np.searchsorted(self.keys, cell_keys(rows, col0), side='left')
+        ends = np.searchsorted(self.keys, cell_keys(rows, col1), side='right')
+        return np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)])
+
+    def bbox(self, south, west, north, east):
+        # frame positions of the points inside the box, for example the map viewport
+        found = self._candidates(south, west, north, east)
+        inside = (self.lat[found] >= south) & (self.lat[found] <= north) & \
+            (self.lon[found] >= west) & (self.lon[found] <= east)
+        return np.sort(self.rows[found[inside]])
+
+    def radius(self, lat, lon, meters):
+        # frame positions of the points within meters of (lat, lon)
+        lat_delta = meters / METERS_PER_DEGREE
+        lon_delta = lat_delta / np.cos(np.radians(lat))
+        found = self._candidates(lat - lat_delta, lon - lon_delta, lat + lat_delta, lon + lon_delta)
+        inside = distance_meters(lat, lon, self.lat[found], self.lon[found]) <= meters
+        return np.sort(self.rows[found[inside]])
+
+    def count_radius(self, lat, lon, meters):
+        return len(self.radius(lat, lon, meters))
+
+    def hotspots(self, k=10, size=None):
+        # the k cells with the most points, cells of size meters are whole index cells
+        factor = max(1, int(round((size or self.size) / self.size)))
+        row, col = key_cells(self.keys)
+        keys, counts = np.unique(cell_keys(row // factor, col // factor), return_counts=True)
+        top = np.argsort(-counts, kind='stable')[:k]
+        row, col = key_cells(keys[top])
+        # 格子的中心点
+        return pd.DataFrame({'lat': (row + 0.5) * self.lat_step * factor,
+                             'lon': (col + 0.5) * self.lon_step * factor,
+                             'count': counts[top]})
+
+
+def build_indexes(frame, size=INDEX_CELL_METERS):
+    # start and end point indexes of an OD frame in one table, for storing next to it
+    parts = []
+    for point, (lat, lon) in POINT_COLUMNS.items():
+        part = GridIndex.build(frame[lat], frame[lon], size).to_frame()
+        part.insert(0, 'point', point == 'end')
+        parts.append(part)
+    return pd.concat(parts, ignore_index=True)
+
+
+def split_indexes(table, size=INDEX_CELL_METERS):
+    # {'start': GridIndex, 'end': GridIndex} of a frame or arrow table written by
+    # build_indexes, the start points come first
+    is_end = np.asarray(table['point'])
+    boundary = int(np.searchsorted(is_end, True))
+    return {'start': GridIndex.from_columns(table, 0, boundary, size),
+            'end': GridIndex.from_columns(table, boundary, len(is_end), size)}
+
+
+def frame_index(df, point='start', size=INDEX_CELL_METERS):
+    # spatial index of an OD frame's start or end points, cached per content of the
+    # coordinate columns, the helper the model pages hand to generated code
+    lat, lon = POINT_COLUMNS[point]
+    return _frame_indexes.get_or_compute((content_hash(df[[lat, lon]]), point, size),
+                                         lambda: GridIndex.build(df[lat], df[lon], size))
+
+
+def viewport_bbox(lat, lon, zoom, width=800, height=600):
+    # (south, west, north, east) seen by a pydeck view of width x height pixels
+    lat_delta = height / 2 * cell_size(zoom, pixels=1) / METERS_PER_DEGREE
+    lon_delta = width / 2 * cell_size(zoom, pixels=1) / METERS_PER_DEGREE / np.cos(np.radians(REF_LAT))
+    return lat - lat_delta, lon - lon_delta, lat + lat_delta, lon + lon_delta
+
+
+def cell_centers(keys, size):
+    # (lat, lon) of the centers of the cells with the given keys
+    row, col = key_cells(np.asarray(keys))
+    _, _, lat_step, lon_step = grid_cells([], [], size)
+    return (row + 0.5) * lat_step, (col + 0.5) * lon_step
@@ -0,0 +1,71 @@
+import hashlib
+import odtypes
+import spatial
+from schema import content_hash
+
+
+def cache_tool_results(tool, results):
+    # The agent often re-runs the same dataframe snippet within a conversation,
+    # answer repeated snippets from the conversation's results instead of executing them again.
+    # The python tool keeps its state between snippets, and any snippet that runs may change
+    # df, so every executed snippet drops the results of the ones before it.
+    run = tool._run
+
+    def cached_run(query, *args, **kwargs):
+        key = query.strip() if isinstance(query, str) else repr(query)
+        if key not in results:
+            result = run(query, *args, **kwargs)
+            results.clear()
+            results[key] = result
+        return results[key]
+    # tools are pydantic models, bypass their field validation
+    object.__setattr__(tool, '_run', cached_run)
+
+
+def create_agent(llm, df):
+    from langchain.agents import AgentType
+    from langchain_experimental.agents import create_pandas_dataframe_agent
+    kwargs = {}
+    is_od = odtypes.is_od_frame(df)
+    if is_od:
+        # OD data gets the spatial index helper in the python tool
+        kwargs['prefix'] = ("You are working with a pandas dataframe in Python. "
+                            "The name of the dataframe is `df`. " + spatial.HELPER_PROMPT)
+    # the frame is shared by every session through the registry, the agent's python tool
+    # gets its own shallow copy so added or dropped columns stay in this agent
+    agent = create_pandas_dataframe_agent(
+        llm,
+        df.copy(deep=False),
+        verbose=True,
+        agent_type=AgentType.OPENAI_FUNCTIONS,
+        handle_parsing_errors=True,
+        **kwargs,
+    )
+    tool_results = {}
+    for tool in agent.tools:
+        if is_od and hasattr(tool, 'locals'):
+            tool.locals['od_index'] = spatial.frame_index
+        cache_tool_results(tool, tool_results)
+    return {'agent': agent, 'tool_results': tool_results}
+
+
+def agent_key(dataset_name, df, model, api_key):
+    # a new agent is only needed when the dataset, its content, the model or the key change,
+    # the full hash also catches a re-upload that only corrects a few rows
+    return (dataset_name, content_hash(df), model,
+            hashlib.sha256((api_key or '').encode()).hexdigest())
+
+
+def get_agent(session_state, llm, dataset_name, df, model, api_key):
+    # the agent of this session, kept across turns in the session state
+    key = agent_key(dataset_name, df, model, api_key)
+    runtime = session_state.get('agent')
+    if runtime is None or runtime['key'] != key:
+        runtime = create_agent(llm, df)
+        runtime['key'] = key
+        session_state['agent'] = runtime
+    return runtime['agent']
+
+
+def reset_agent(session_state):
+    session_state.pop('agent', None)
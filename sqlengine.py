@@ -0,0 +1,172 @@
+import os
+import json
+import re
+import threading
+import odstore
+import llmcache
+import llm_gateway
+
+# SQL模式: 列式存储的OD分区和上传的文件注册为DuckDB里的表
+# rows returned to the page, the query itself always runs over the full tables
+MAX_ROWS = 10000
+MEMORY_LIMIT = '2GB'
+# only read-only statements generated by the model are executed
+READ_ONLY = re.compile(r'^\s*(select|with|describe|show|summarize|explain)\b', re.IGNORECASE)
+SQL_BLOCK = re.compile(r'```(?:sql)?\s*(.*?)```', re.IGNORECASE | re.DOTALL)
+
+# DuckDB names are case-insensitive, so ID of the OD data would clash with id
+RENAMES = {'ID': 'order_id'}
+
+_lock = threading.Lock()
+_connection = None
+# table name -> (version, arrow dataset)
+_datasets = {}
+
+
+def get_connection():
+    # one in-memory database per process, each session queries through its own cursor
+    global _connection
+    with _lock:
+        if _connection is None:
+            # imported on the first SQL question, not when the page loads
+            import duckdb
+            _connection = duckdb.connect()
+            _connection.execute(f"SET memory_limit = '{MEMORY_LIMIT}'")
+            # generated SQL can only read the registered tables, not arbitrary files
+            _connection.execute("SET enable_external_access = false")
+        return _connection
+
+
+def store_tables(od_dir=odstore.OD_DIR, store_dir=odstore.STORE_DIR):
+    # od: every trip of the month, weekN: the trips of one week,
+    # trips_daily: orders and hours per vehicle and day.
+    # The arrow datasets scan the feather partitions lazily, so only the columns and
+    # partitions a query needs are read. They are rebuilt when a partition changes.
+    import pyarrow.dataset as ds
+    weeks = odstore.week_list(od_dir)
+    versions = {week: odstore.ingest_week(week, od_dir, store_dir) for week in weeks}
+    days = {week: [day for day, _ in odstore.day_files(week, od_dir)] for week in weeks}
+    wanted = {week: (versions[week], [odstore.partition_path(week, day, store_dir)
+                                      for day in days[week]]) for week in weeks}
+    version = ''.join(versions[week] for week in weeks)
+    wanted['od'] = (version, [path for week in weeks for path in wanted[week][1]])
+    wanted['trips_daily'] = (version, [odstore.summary_path(week, day, store_dir)
+                                       for week in weeks for day in days[week]])
+    tables = {}
+    with _lock:
+        for name, (table_version, paths) in wanted.items():
+            cached = _datasets.get(name)
+            if cached is None or cached[0] != table_version:
+                paths = [path for path in paths if os.path.exists(path)]
+                if not paths:
+                    continue
+                cached = _datasets[name] = (table_version, ds.dataset(paths, format='feather'))
+            tables[name] = cached[1]
+    return tables
+
+
+def table_name(name):
+    # upload names become lower case identifiers
+    name = re.sub(r'\W+', '_', str(name).strip().lower()).strip('_')
+    if not name or name[0].isdigit():
+        name = 'upload_' + name
+    return name
+
+
+def is_read_only(sql):
+    statements = [s for s in sql.split(';') if s.strip()]
+    return len(statements) == 1 and READ_ONLY.match(statements[0]) is not None
+
+
+def extract_sql(text):
+    # the model may wrap its answer in a markdown code block
+    match = SQL_BLOCK.search(text)
+    sql = match.group(1) if match else text
+    return sql.strip().rstrip(';').strip()
+
+
+class SqlSession:
+    # The tables one session can query: the shared store tables plus its uploads.
+    # Registered objects and temp views are local to the cursor, so uploads never leak
+    # between sessions.
+
+    def __init__(self, connection=None):
+        self._cursor = (connection or get_connection()).cursor()
+        self._registered = {}
+
+    def _register(self, name, data):
+        # The data is registered under a source name and queried through a view that
+        # renames the columns in RENAMES, matched by position since DuckDB would
+        # otherwise call the second of two clashing columns ID_1.
+        if self._registered.get(name) is not data:
+            source = '_source_' + name
+            self._cursor.register(source, data)
+            names = data.schema.names if hasattr(data, 'schema') else [str(c) for c in data.columns]
+            columns = [row[0] for row in self._cursor.execute(f'DESCRIBE "{source}"').fetchall()]
+            projection = ', '.join(f'"{column}" AS "{RENAMES[original]}"' if original in RENAMES
+                                   else f'"{column}"' for original, column in zip(names, columns))
+            self._cursor.execute(f'CREATE OR REPLACE TEMP VIEW "{name}" AS '
+                                 f'SELECT {projection} FROM "{source}"')
+            self._registered[name] = data
+
+    def _unregister(self, name):
+        self._cursor.execute(f'DROP VIEW IF EXISTS "{name}"')
+        self._cursor.unregister('_source_' + name)
+        del self._registered[name]
+
+    def sync(self, uploads=None):
+        # returns {table name: source name} of the tables available to this session
+        names = {}
+        for name, dataset in store_tables().items():
+            self._register(name, dataset)
+            names[name] = name
+        for name, frame in (uploads or {}).items():
+            if frame is None:
+                continue
+            self._register(table_name(name), frame)
+            names[table_name(name)] = name
+        for name in list(self._registered):
+            if name not in names:
+                self._unregister(name)
+        return names
+
+    def columns(self, name):
+        return [(row[0], row[1]) for row in self._cursor.execute(f'DESCRIBE "{name}"').fetchall()]
+
+    def describe(self, names):
+        # schema primer: one line per table with its columns and DuckDB types
+        lines = []
+        for name in names:
+            lines.append(f'{name}(' + ', '.join(f'{column} {dtype}'
+                                                for column, dtype in self.columns(name)) + ')')
+        return '\n'.join(lines)
+
+    def query(self, sql, max_rows=MAX_ROWS):
+        if not is_read_only(sql):
+            raise ValueError('Only a single SELECT statement can be run.')
+        return self._cursor.sql(sql).limit(max_rows).df()
+
+
+def build_messages(question, schema, history=()):
+    system = ("You write DuckDB SQL for questions about taxi data in Chengdu, August 2014. "
+              "The tables are:\n" + schema + "\n"
+              "In od and weekN each row is one order, numbered order_id, of vehicle id from "
+              "stime (slon, slat) to etime (elon, elat). trips_daily has the orders and working hours of each "
+              "vehicle per date. Answer with a single SELECT statement in a ```sql``` block "
+              "and nothing else. Aggregate in SQL instead of returning raw rows.")
+    # earlier turns let follow-up questions refer to previous queries
+    return [{"role": "system", "content": system}, *history,
+            {"role": "user", "content": question}]
+
+
+def generate_sql(question, schema, model, key, history=()):
+    # same question against the same tables and context is answered from the response cache
+    messages = build_messages(question, schema, history)
+    cache = llmcache.get_cache()
+    cache_key = llmcache.make_key(json.dumps(messages, ensure_ascii=False),
+                                  llm_gateway.resolve_model(model))
+    response = cache.get(cache_key)
+    if response is None:
+        response = llm_gateway.get_gateway().complete(model, messages, key)
+        cache.put(cache_key, response)
+    return extract_sql(response)
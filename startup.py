@@ -0,0 +1,92 @@
+import os
+import sys
+import json
+import time
+import threading
+from datetime import datetime
+
+# 启动耗时: 各页面的导入和首屏时间，以及服务启动时在后台预加载的数据
+STARTUP_LOG = 'logs/startup.jsonl'
+# imported first by every page, so this is close to the start of the server process
+PROCESS_STARTED = time.perf_counter()
+
+_lock = threading.Lock()
+_preload = None
+_report = {'preload': {}, 'pages': {}}
+_runs = threading.local()
+
+
+def timed(name, func, *args):
+    start = time.perf_counter()
+    try:
+        func(*args)
+        _report['preload'][name] = round(time.perf_counter() - start, 3)
+    except Exception as e:
+        _report['preload'][name] = f'failed: {e}'
+
+
+def preload_data():
+    # Convert new day files and read the small tables every dashboard view starts from,
+    # so the first session finds them in memory. Only partitions and summaries are
+    # touched, optional backends (langchain, transbigdata, duckdb) stay unimported.
+    import odstore
+    import odflow
+    from registry import PRELOADED
+    start = time.perf_counter()
+    timed('ingest', odstore.ingest)
+    days = odstore.day_index()
+    if days:
+        first, last = days[0][0], days[-1][0]
+        timed('summaries', odstore.load_range_summary, first, last)
+        timed('spatial_index', odstore.load_range_index, first, last)
+        timed('flows', odflow.range_flows, first, last, None)
+    # the days the model pages open by default
+    for name, (week, day) in PRELOADED.items():
+        timed('dataset ' + name, odstore.load_day, week, day)
+    _report['preload']['total'] = round(time.perf_counter() - start, 3)
+    _report['preload']['finished_after_start'] = round(time.perf_counter() - PROCESS_STARTED, 3)
+
+
+def start():
+    # start the background preload once per server process, every page calls this
+    global _preload
+    with _lock:
+        if _preload is None:
+            _preload = threading.Thread(target=preload_data, name='preload', daemon=True)
+            _preload.start()
+    return _preload
+
+
+def page_started(page):
+    # mark the start of a script run, before the page imports its modules
+    _runs.started = getattr(_runs, 'started', {})
+    _runs.started[page] = time.perf_counter()
+
+
+def mark(page, step):
+    # seconds since page_started, recorded for the first run of the page in this process
+    elapsed = round(time.perf_counter() - _runs.started[page], 3)
+    with _lock:
+        steps = _report['pages'].setdefault(page, {})
+        if step not in steps:
+            steps[step] = elapsed
+            if step == 'first_paint':
+                write_log(page, steps)
+    return elapsed
+
+
+def write_log(page, steps, path=STARTUP_LOG):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    entry = {'time': datetime.now().isoformat(timespec='seconds'), 'pid': os.getpid(),
+             'page': page, 'since_start': round(time.perf_counter() - PROCESS_STARTED, 3),
+             'modules': len(sys.modules), **steps}
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+
+def report():
+    # import, first paint and preload times of this process, for the dashboard sidebar
+    with _lock:
+        return {'pages': {page: dict(steps) for page, steps in _report['pages'].items()},
+                'preload': dict(_report['preload']),
+                'preload_running': _preload is not None and _preload.is_alive()}
@@ -0,0 +1,41 @@
+from boundedcache import BoundedCache
+from figstore import FigureStore
+
+
+def test_evicts_least_recently_used_entry():
+    cache = BoundedCache(max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c'), len(cache)) == (1, 3, 2)
+
+
+def test_size_budget_keeps_the_newest_entry():
+    cache = BoundedCache(max_size=10)
+    cache.put('a', b'12345')
+    cache.put('b', b'123456')
+    assert cache.get('a') is None and cache.get('b') == b'123456'
+    cache.put('big', b'x' * 20)
+    assert cache.get('b') is None and len(cache) == 1
+    # replacing an entry counts only its new size
+    cache.put('big', b'xy')
+    cache.put('c', b'12345678')
+    assert cache.get('big') == b'xy'
+
+
+def test_get_or_compute_computes_once():
+    cache = BoundedCache(max_entries=4)
+    calls = []
+    for _ in range(3):
+        assert cache.get_or_compute('key', lambda: calls.append(1) or 'value') == 'value'
+    assert calls == [1]
+
+
+def test_figure_store_is_content_addressed():
+    store = FigureStore(max_bytes=10)
+    digest = store.put(b'png')
+    assert store.put(b'png') == digest and store.get(digest) == b'png'
+    store.put(b'x' * 10)
+    assert store.get(digest) is None and store.get(None) is None and store.get(False) is None
@@ -0,0 +1,60 @@
+import chatcontext
+from chatcontext import ConversationContext
+
+
+def turn(words):
+    return ' '.join(['word'] * words)
+
+
+def recording_summarizer(calls, response='summary'):
+    def summarize(summary, turns):
+        calls.append((summary, turns))
+        return response
+    return summarize
+
+
+def test_turns_are_kept_within_budget():
+    context = ConversationContext(window_tokens=100)
+    for _ in range(3):
+        context.add('user', turn(20))
+    calls = []
+    messages = context.messages(recording_summarizer(calls))
+    assert calls == [] and len(messages) == 3
+    assert context.tokens() == context.window_count
+
+
+def test_fold_moves_the_oldest_turns_into_the_summary():
+    context = ConversationContext(window_tokens=100)
+    for i in range(6):
+        context.add('user', f'{i} ' + turn(80))
+    calls = []
+    messages = context.messages(recording_summarizer(calls))
+    # folded in one batch down to REFILL_RATIO of the window, the newest turn stays
+    assert len(calls) == 1 and calls[0][0] == ''
+    assert [t['content'][0] for t in calls[0][1]] == ['0', '1', '2', '3', '4']
+    assert [m['content'][0] for m in messages[1:]] == ['5']
+    assert messages[0]['content'].endswith('summary')
+    # the next fold continues from the summary
+    context.add('user', turn(80))
+    context.add('user', turn(80))
+    context.messages(recording_summarizer(calls))
+    assert calls[1][0] == 'summary'
+
+
+def test_fold_without_summarizer_drops_turns():
+    context = ConversationContext(window_tokens=100)
+    for _ in range(4):
+        context.add('user', turn(80))
+    assert len(context.messages()) == 1
+    assert context.summary == ''
+
+
+def test_long_summary_is_cut_to_its_budget():
+    for text in (turn(2000), '数据' * 2000):
+        context = ConversationContext(window_tokens=10, summary_tokens=50)
+        context.add('user', turn(40))
+        context.add('user', turn(40))
+        context.fold(recording_summarizer([], response=text + 'end'))
+        assert context.summary.endswith('end')
+        assert context.summary_count <= 50
+        assert context.summary_count == chatcontext.count_tokens(context.summary)
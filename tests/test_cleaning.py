@@ -0,0 +1,98 @@
+import pathlib
+import pandas as pd
+import pytest
+import cleaning
+from benchmarks import synthetic
+
+pytest.importorskip('transbigdata')
+
+COLS = {'id': 'VehicleNum', 'time': 'Time', 'lon': 'Lng', 'lat': 'Lat', 'status': 'OpenStatus'}
+CLEAR_OPTS = ['稀疏化', '删除漂移', '删除相同的数据', '删除瞬时变化']
+OP_OPTS = ['提取OD', '提取配送和闲置轨迹']
+SORT_KEYS = {'clear_data': ['VehicleNum', 'Time'], 'oddata': ['VehicleNum', 'stime'],
+             'data_deliver': ['VehicleNum', 'Time', 'ID'], 'data_idle': ['VehicleNum', 'Time', 'ID']}
+
+
+def comparable(results):
+    return {name: frame.sort_values(SORT_KEYS[name], kind='stable').reset_index(drop=True)
+            for name, frame in results.items()}
+
+
+def assert_same_results(results, expected):
+    assert results.keys() == expected.keys()
+    results, expected = comparable(results), comparable(expected)
+    for name in expected:
+        pd.testing.assert_frame_equal(results[name], expected[name], check_dtype=False)
+
+
+def by_order_start(results):
+    starts = results['oddata'].set_index('ID')['stime']
+    return {name: frame.assign(ID=starts.reindex(frame['ID'].to_numpy()).to_numpy())
+            if 'ID' in frame else frame for name, frame in results.items()}
+
+
+@pytest.fixture(scope='module')
+def gps():
+    return synthetic.gps(40, minutes=600)
+
+
+@pytest.mark.parametrize('time_gap', [None, 300])
+def test_parallel_matches_single(gps, time_gap):
+    expected = cleaning.run_steps(gps.copy(), COLS, CLEAR_OPTS, OP_OPTS, time_gap)
+    results = cleaning.parallel_steps(gps.copy(), COLS, CLEAR_OPTS, OP_OPTS, time_gap, workers=4)
+    assert_same_results(results, expected)
+
+
+def test_sparsify_keeps_first_point_per_vehicle_window():
+    data = pd.DataFrame({'VehicleNum': [2, 1, 1, 1, 2],
+                         'Time': pd.to_datetime(['2014-08-03 00:00:30', '2014-08-03 00:00:10',
+                                                 '2014-08-03 00:00:50', '2014-08-03 00:01:05',
+                                                 '2014-08-03 00:00:40'])})
+    result = cleaning.sparsify(data, ['VehicleNum', 'Time'], 60)
+    assert result['VehicleNum'].tolist() == [1, 1, 2]
+    assert result['Time'].dt.second.tolist() == [10, 5, 30]
+
+
+def test_stream_matches_single(gps, tmp_path):
+    source = tmp_path / 'gps.csv'
+    gps.to_csv(source, index=False)
+    expected = cleaning.run_steps(gps.copy(), COLS, CLEAR_OPTS, OP_OPTS, 300)
+    outputs = cleaning.stream_clean(source, COLS, CLEAR_OPTS, OP_OPTS, 300, chunksize=5000,
+                                    total_bytes=source.stat().st_size)
+    try:
+        results = {name: pd.read_csv(path, parse_dates=['stime', 'etime'] if name == 'oddata'
+                                     else ['Time'])
+                   for name, path in outputs.items()}
+    finally:
+        cleaning.remove_outputs(outputs)
+    assert not pathlib.Path(outputs['clear_data']).parent.exists()
+    # streaming numbers the orders bucket by bucket, compare them by vehicle and start time
+    assert_same_results(by_order_start(results), by_order_start(expected))
+
+
+def test_overlapping_runs_share_tracing():
+    first, second = cleaning.RunLog(), cleaning.RunLog()
+    frame = pd.DataFrame({'a': range(10)})
+    with first.stage('one', frame):
+        pass
+    with second.stage('one', frame):
+        pass
+    first.close()
+    # the second run still traces after the first one finished
+    with second.stage('two', frame):
+        assert cleaning.tracemalloc.is_tracing()
+        data = bytearray(4 * 2 ** 20)
+    del data
+    assert second.stages[-1]['peak_mb'] >= 4
+    second.close()
+    assert not cleaning.tracemalloc.is_tracing()
+
+
+def test_failed_stream_run_stops_tracing(gps, tmp_path):
+    source = tmp_path / 'gps.csv'
+    gps.head(100).assign(Speed='慢').to_csv(source, index=False, encoding='gbk')
+    log = cleaning.RunLog()
+    with pytest.raises(UnicodeDecodeError):
+        cleaning.stream_clean(source, COLS, CLEAR_OPTS, OP_OPTS, encoding='utf-8', log=log)
+    assert not cleaning.tracemalloc.is_tracing()
+    assert cleaning._trace_runs == 0
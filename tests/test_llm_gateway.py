@@ -0,0 +1,106 @@
+import asyncio
+import threading
+import pytest
+import llm_gateway
+
+MESSAGES = [{'role': 'user', 'content': 'orders per hour'}]
+
+
+class SlowGateway(llm_gateway.Gateway):
+    # answers after a short delay and records the key of every call that reached the backend,
+    # the first len(failures) calls raise those errors instead
+    def __init__(self, failures=(), **kwargs):
+        super().__init__(**kwargs)
+        self.calls = []
+        self.failures = list(failures)
+
+    async def _call(self, model, messages, key):
+        self.calls.append(key)
+        await asyncio.sleep(0.2)
+        if self.failures:
+            raise self.failures.pop(0)
+        return f'answer with {key}'
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(llm_gateway, 'BACKOFF_SECONDS', 0.001)
+
+
+def complete_all(gateway, keys):
+    results = {}
+
+    def complete(key):
+        try:
+            results[key] = gateway.complete('stub', MESSAGES, key)
+        except Exception as e:
+            results[key] = e
+    threads = [threading.Thread(target=complete, args=(key,)) for key in keys]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_requests_on_different_keys_are_not_coalesced():
+    gateway = SlowGateway()
+    results = complete_all(gateway, ['keyA', 'keyB', 'keyC'])
+    assert sorted(gateway.calls) == ['keyA', 'keyB', 'keyC']
+    assert results == {key: f'answer with {key}' for key in ('keyA', 'keyB', 'keyC')}
+
+
+def test_identical_requests_share_one_call():
+    gateway = SlowGateway()
+    results = complete_all(gateway, ['key'] * 3)
+    assert gateway.calls == ['key']
+    assert results == {'key': 'answer with key'}
+    assert gateway._inflight == {}
+
+
+def test_failed_call_reaches_every_waiter_and_is_not_kept():
+    gateway = SlowGateway(failures=[ValueError('bad request')])
+    errors = []
+
+    def complete():
+        try:
+            gateway.complete('stub', MESSAGES, 'key')
+        except ValueError as e:
+            errors.append(e)
+    threads = [threading.Thread(target=complete) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # not retryable, one call for all three waiters
+    assert gateway.calls == ['key'] and len(errors) == 3
+    assert gateway._inflight == {}
+    assert gateway.complete('stub', MESSAGES, 'key') == 'answer with key'
+
+
+def test_transient_errors_are_retried():
+    gateway = SlowGateway(failures=[ConnectionError(), TimeoutError()])
+    assert gateway.complete('stub', MESSAGES, 'key') == 'answer with key'
+    assert len(gateway.calls) == 3
+
+
+def test_retries_give_up():
+    failures = [ConnectionError()] * (llm_gateway.RETRIES + 1)
+    gateway = SlowGateway(failures=failures)
+    with pytest.raises(ConnectionError):
+        gateway.complete('stub', MESSAGES, 'key')
+    assert len(gateway.calls) == llm_gateway.RETRIES + 1
+
+
+def test_retryable():
+    assert llm_gateway.retryable(ConnectionError())
+    assert llm_gateway.retryable(TimeoutError())
+    assert not llm_gateway.retryable(ValueError())
+    assert not llm_gateway.retryable(KeyError('choices'))
+
+
+def test_stub_backend(monkeypatch):
+    monkeypatch.setenv('LLM_BACKEND', 'stub')
+    gateway = llm_gateway.Gateway(stub_response='answer')
+    assert gateway.complete('gpt-4', MESSAGES, 'key') == 'answer'
+    assert ''.join(gateway.stream('gpt-4', MESSAGES, 'key')) == 'answer'
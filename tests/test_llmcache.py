@@ -0,0 +1,41 @@
+import pytest
+import llmcache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # a clock that only moves when the test moves it
+    now = [1000.0]
+    monkeypatch.setattr(llmcache.time, 'time', lambda: now[0])
+    return now
+
+
+def test_make_key_ignores_whitespace():
+    assert llmcache.make_key('a  b\n', 'gpt-4') == llmcache.make_key('a b', 'gpt-4')
+    assert llmcache.make_key('a b', 'gpt-4') != llmcache.make_key('a b', 'gpt-4o')
+
+
+def test_expired_responses_are_dropped(tmp_path, clock):
+    cache = llmcache.ResponseCache(str(tmp_path / 'cache.sqlite3'), ttl=10)
+    cache.put('old', 'answer')
+    assert cache.get('old') == 'answer'
+    clock[0] += 11
+    assert cache.get('old') is None
+    # put also clears expired rows it never reads
+    cache.put('stale', 'answer')
+    clock[0] += 11
+    cache.put('new', 'answer')
+    assert cache._db.execute('SELECT key FROM responses').fetchall() == [('new',)]
+
+
+def test_least_recently_used_is_evicted(tmp_path, clock):
+    cache = llmcache.ResponseCache(str(tmp_path / 'cache.sqlite3'), max_entries=2)
+    cache.put('a', '1')
+    clock[0] += 1
+    cache.put('b', '2')
+    clock[0] += 1
+    assert cache.get('a') == '1'
+    clock[0] += 1
+    cache.put('c', '3')
+    assert cache.get('b') is None
+    assert cache.get('a') == '1' and cache.get('c') == '3'
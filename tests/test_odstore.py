@@ -0,0 +1,60 @@
+import os
+import shutil
+import odstore
+import registry
+
+DAY = 'oddata_20140803_train.txt'
+
+
+def make_week(tmp_path):
+    od_dir = tmp_path / 'odddata'
+    os.makedirs(od_dir / 'week1')
+    shutil.copy(os.path.join(odstore.OD_DIR, 'week1', DAY), od_dir / 'week1' / DAY)
+    return str(od_dir), str(tmp_path / 'store')
+
+
+def test_failed_file_is_recorded_and_skipped(tmp_path, monkeypatch):
+    od_dir, store_dir = make_week(tmp_path)
+    odstore.ingest_week('week1', od_dir, store_dir)
+    partition = odstore.partition_path('week1', '20140803', store_dir)
+    assert os.path.exists(partition)
+
+    source = os.path.join(od_dir, 'week1', DAY)
+    with open(source, 'w') as f:
+        f.write('id,stime\n"1,2\n')
+    version = odstore.ingest_week('week1', od_dir, store_dir)
+    entry = odstore.load_manifest(store_dir)[source]
+    assert 'error' in entry and entry['size'] == os.path.getsize(source)
+    # the partition of the earlier content is gone
+    assert not os.path.exists(partition)
+    assert not os.path.exists(odstore.summary_path('week1', '20140803', store_dir))
+    assert not os.path.exists(odstore.index_path('week1', '20140803', store_dir))
+
+    # unchanged, the file is not parsed again
+    def fail(path):
+        raise AssertionError('parsed again')
+    monkeypatch.setattr(odstore, 'read_day_file', fail)
+    assert odstore.ingest_week('week1', od_dir, store_dir) == version
+    monkeypatch.undo()
+
+    # fixed, it is converted again
+    shutil.copy(os.path.join(odstore.OD_DIR, 'week1', DAY), source)
+    assert odstore.ingest_week('week1', od_dir, store_dir) != version
+    assert 'error' not in odstore.load_manifest(store_dir)[source]
+    assert os.path.exists(partition)
+
+
+def test_registry_reloads_a_rewritten_day(tmp_path):
+    od_dir, store_dir = make_week(tmp_path)
+    datasets = registry.DatasetRegistry(
+        {'day': lambda: odstore.load_day('week1', '20140803', od_dir, store_dir)},
+        versions={'day': lambda: odstore.day_version('week1', '20140803', od_dir, store_dir)})
+    first = datasets.acquire('day')
+    assert datasets.acquire('day') is first
+    source = os.path.join(od_dir, 'week1', DAY)
+    with open(source) as f:
+        lines = f.readlines()
+    with open(source, 'w') as f:
+        f.writelines(lines[:101])
+    second = datasets.acquire('day')
+    assert len(second) == 100 and len(first) > 100
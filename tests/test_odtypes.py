@@ -0,0 +1,13 @@
+import pandas as pd
+import odtypes
+
+
+def test_compact_ids_are_signed():
+    ids = odtypes.compact_ids(pd.Series([3, 1, 2]))
+    assert ids.dtype == 'int32'
+    assert ids.diff().tolist()[1:] == [-2, 1]
+
+
+def test_compact_ids_leave_large_ids_alone():
+    ids = pd.Series([0, 2 ** 31])
+    assert odtypes.compact_ids(ids).dtype == 'int64'
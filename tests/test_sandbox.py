@@ -0,0 +1,61 @@
+import time
+import threading
+import pandas as pd
+import pytest
+import odstore
+import registry
+from sandbox import Sandbox
+
+pytest.importorskip('matplotlib')
+
+PLOT = "import matplotlib.pyplot as plt\nplt.plot([1, 2])\n"
+
+
+def test_render_survives_a_pool_killed_by_another_session():
+    sandbox = Sandbox(workers=2, wall_seconds=20)
+    # a first render waits for the workers to start
+    sandbox.render(PLOT)
+    results = {}
+
+    def render():
+        try:
+            results['png'] = sandbox.render('import time\ntime.sleep(2)\n' + PLOT)
+        except Exception as e:
+            results['error'] = e
+    thread = threading.Thread(target=render)
+    thread.start()
+    time.sleep(1)
+    # what a timeout of another session's script does to the pool
+    sandbox._restart(sandbox._get_pool())
+    thread.join()
+    sandbox._restart(sandbox._get_pool())
+    assert 'error' not in results
+    assert results['png'].startswith(b'\x89PNG')
+
+
+def test_timeout():
+    sandbox = Sandbox(workers=1, wall_seconds=2)
+    with pytest.raises(TimeoutError):
+        sandbox.render('while True:\n    pass\n')
+
+
+def test_figure_key_follows_uploads_and_store(monkeypatch):
+    sandbox = Sandbox()
+    frame = pd.DataFrame({'a': range(20000)})
+    edited = frame.copy()
+    edited.loc[12345, 'a'] = -1
+    code = 'datasets["mine"].plot()'
+    assert sandbox.figure_key(code, {'mine': frame}) != sandbox.figure_key(code, {'mine': edited})
+    versions = iter([1, 1, 2])
+    monkeypatch.setattr(odstore, 'day_version', lambda week, day: next(versions))
+    code = 'datasets["Week1"].plot()'
+    first = sandbox.figure_key(code, {})
+    assert sandbox.figure_key(code, {}) == first
+    assert sandbox.figure_key(code, {}) != first
+
+
+def test_worker_registry_does_not_ingest(monkeypatch):
+    def ingest(*args):
+        raise AssertionError('ingested')
+    monkeypatch.setattr(odstore, 'ingest_week', ingest)
+    registry.store_registry(ingest=False).acquire('Week1')
@@ -0,0 +1,17 @@
+import numpy as np
+import pandas as pd
+import spatial
+
+
+def od_frame(slat):
+    return pd.DataFrame({'slat': slat, 'slon': np.full(len(slat), 104.06)})
+
+
+def test_frame_index_is_per_coordinates():
+    first = od_frame(np.linspace(30.6, 30.7, 20000))
+    second = first.copy()
+    second.loc[12345, 'slat'] = 30.9
+    assert spatial.frame_index(first) is spatial.frame_index(first.copy())
+    index = spatial.frame_index(second)
+    assert index is not spatial.frame_index(first)
+    assert 12345 in index.radius(30.9, 104.06, 100)
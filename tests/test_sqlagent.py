@@ -0,0 +1,34 @@
+import pandas as pd
+import sqlagent
+
+
+def test_agent_key_changes_with_any_row():
+    frame = pd.DataFrame({'id': range(20000), 'slon': 104.0})
+    edited = frame.copy()
+    edited.loc[12345, 'slon'] = 104.1
+    assert sqlagent.agent_key('Week1', frame, 'gpt-4', 'key') == \
+        sqlagent.agent_key('Week1', frame.copy(), 'gpt-4', 'key')
+    assert sqlagent.agent_key('Week1', frame, 'gpt-4', 'key') != \
+        sqlagent.agent_key('Week1', edited, 'gpt-4', 'key')
+
+
+class Repl:
+    # stands in for the agent's python tool, which keeps df between snippets
+    def __init__(self):
+        self.df = pd.DataFrame({'a': [1]})
+
+    def _run(self, query):
+        if query.startswith('df["x"]'):
+            self.df['x'] = 1
+            return ''
+        return str(list(self.df.columns))
+
+
+def test_tool_results_follow_mutations():
+    tool = Repl()
+    results = {}
+    sqlagent.cache_tool_results(tool, results)
+    assert tool._run('df.columns') == "['a']"
+    assert tool._run('df.columns ') == "['a']"
+    tool._run('df["x"] = 1')
+    assert tool._run('df.columns') == "['a', 'x']"
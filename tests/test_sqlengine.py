@@ -0,0 +1,15 @@
+import duckdb
+import pandas as pd
+import sqlengine
+
+
+def test_order_ids_do_not_clash_with_vehicle_ids(monkeypatch):
+    monkeypatch.setattr(sqlengine, 'store_tables', lambda: {})
+    session = sqlengine.SqlSession(duckdb.connect())
+    upload = pd.DataFrame({'id': [7, 8], 'ID': [0, 1]})
+    assert session.sync({'trips': upload}) == {'trips': 'trips'}
+    assert session.columns('trips') == [('id', 'BIGINT'), ('order_id', 'BIGINT')]
+    assert session.query('SELECT id, order_id FROM trips WHERE id = 8').values.tolist() == [[8, 1]]
+    session.sync({})
+    assert session.describe([]) == ''
+    assert 'trips' not in session._registered
@@ -0,0 +1,17 @@
+import pandas as pd
+import timeparse
+
+
+def test_parse_keeps_time_zone():
+    series = pd.Series(['2014-08-03 08:00:00+08:00', None, '2014-08-03 08:00:00+08:00'])
+    parsed = timeparse.parse(series)
+    assert str(parsed.dt.tz) == 'UTC+08:00'
+    assert parsed[0].hour == 8
+    assert parsed.isna().tolist() == [False, True, False]
+
+
+def test_parse_naive_strings():
+    parsed = timeparse.parse(pd.Series(['2014/08/03 08:00:00', None, '2014/08/03 08:00:00']))
+    assert parsed.dt.tz is None
+    assert parsed.tolist()[0] == pd.Timestamp('2014-08-03 08:00:00')
+    assert pd.isna(parsed[1])
@@ -0,0 +1,55 @@
+import pandas as pd
+
+# 常见的时间格式，按顺序尝试
+CANDIDATE_FORMATS = [
+    '%Y/%m/%d %H:%M:%S',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y/%m/%d %H:%M',
+    '%Y-%m-%d %H:%M',
+    '%Y%m%d%H%M%S',
+    '%Y/%m/%d',
+    '%Y-%m-%d',
+    '%H:%M:%S',
+]
+SAMPLE_SIZE = 100
+
+
+def detect_format(values):
+    # first candidate format that parses every value of a small sample
+    sample = pd.Series(values).dropna().astype(str).iloc[:SAMPLE_SIZE]
+    if sample.empty:
+        return None
+    for fmt in CANDIDATE_FORMATS:
+        try:
+            pd.to_datetime(sample, format=fmt)
+            return fmt
+        except (ValueError, TypeError):
+            continue
+    return None
+
+
+def parse(series, fmt=None):
+    # Parse a column of timestamp strings with one fixed format detected from a sample.
+    # Repeated strings, common in minute-resolution GPS, are parsed only once.
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return series
+    if not (pd.api.types.is_object_dtype(series.dtype) or pd.api.types.is_string_dtype(series.dtype)):
+        return pd.to_datetime(series)
+    codes, uniques = pd.factorize(series)
+    if len(uniques) == 0:
+        return pd.to_datetime(series)
+    uniques = pd.Index(uniques).astype(str)
+    fmt = fmt or detect_format(uniques)
+    parsed = None
+    if fmt is not None:
+        try:
+            parsed = pd.to_datetime(uniques, format=fmt)
+        except (ValueError, TypeError):
+            # a later value does not match the sampled format
+            parsed = None
+    if parsed is None:
+        parsed = pd.to_datetime(uniques, format='mixed')
+    # take keeps the dtype of the parsed values, time zone included, -1 codes are missing values
+    values = parsed.take(codes, allow_fill=True, fill_value=pd.NaT)
+    return pd.Series(values, index=series.index, name=series.name)